@@ -13,6 +13,29 @@ from pathlib import Path
 from datetime import datetime
 
 
+# The Netscape format has no ordering requirement, so rows are read in
+# table order rather than sorting on unindexed columns
+COOKIES_QUERY = """
+    SELECT host, path, isSecure, expiry, name, value, isHttpOnly
+    FROM moz_cookies
+"""
+
+# Buffer size for writing the cookie file (1 MiB)
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Netscape cookie files spell booleans out, indexed by the flag's truth value
+BOOL_FLAGS = ("FALSE", "TRUE")
+
+# Read-only pull of every row: keep the page cache, temp storage and file
+# access in memory instead of going through SQLite's conservative defaults
+COOKIES_PRAGMAS = """
+    PRAGMA query_only=1;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-20000;
+    PRAGMA mmap_size=268435456;
+"""
+
+
 def find_firefox_profile():
     """Find the default Firefox profile directory on Windows."""
     appdata = os.getenv('APPDATA')
@@ -52,45 +75,70 @@ def find_firefox_profile():
     return default_profile
 
 
-def get_cookies_from_database(profile_path):
-    """Extract cookies from Firefox's cookies.sqlite database."""
+def get_cookies_from_database(profile_path, batch_size=1024):
+    """Extract cookies from Firefox's cookies.sqlite database.
+    
+    The database is opened and queried up front, so errors are raised here;
+    the returned generator then streams rows in batches of `batch_size` and
+    closes the connection once exhausted.
+    """
     cookies_db = profile_path / "cookies.sqlite"
     
     if not cookies_db.exists():
         raise Exception(f"Cookies database not found: {cookies_db}")
     
-    # Firefox may lock the database, so we'll try to copy it first
-    import shutil
-    import tempfile
+    # Open the live database read-only with immutable=1 so SQLite skips file
+    # locking entirely; Firefox holds a lock on it while running, and this
+    # avoids copying the whole file to a temp location first
+    uri = f"file:{cookies_db.as_posix()}?immutable=1&mode=ro"
     
     temp_db = None
+    conn = None
     try:
-        # Try to open the database directly first
         try:
-            conn = sqlite3.connect(str(cookies_db))
+            conn = sqlite3.connect(uri, uri=True)
             cursor = conn.cursor()
-        except sqlite3.OperationalError:
-            # If locked, copy to temp location
+            cursor.executescript(COOKIES_PRAGMAS)
+            cursor.execute(COOKIES_QUERY)
+        except sqlite3.DatabaseError:
+            # Database could not be read in place (e.g. corrupted), fall back to a copy
+            import shutil
+            import tempfile
+            
+            if conn:
+                conn.close()
             temp_db = tempfile.NamedTemporaryFile(delete=False, suffix='.sqlite')
             temp_db.close()
             shutil.copy2(cookies_db, temp_db.name)
             conn = sqlite3.connect(temp_db.name)
             cursor = conn.cursor()
-        
-        # Query cookies
-        cursor.execute("""
-            SELECT host, path, isSecure, expiry, name, value, isHttpOnly
-            FROM moz_cookies
-            ORDER BY host, path, name
-        """)
-        
-        cookies = cursor.fetchall()
-        conn.close()
-        
-        return cookies
+            cursor.executescript(COOKIES_PRAGMAS)
+            cursor.execute(COOKIES_QUERY)
+    except BaseException:
+        _close_cookies_database(conn, temp_db)
+        raise
+    
+    return _stream_cookies(cursor, conn, temp_db, batch_size)
+
+
+def _stream_cookies(cursor, conn, temp_db, batch_size):
+    """Yield rows from an executed cookies query, one batch in memory at a time."""
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
     finally:
-        if temp_db and os.path.exists(temp_db.name):
-            os.unlink(temp_db.name)
+        _close_cookies_database(conn, temp_db)
+
+
+def _close_cookies_database(conn, temp_db):
+    """Close the cookies connection and remove the temporary copy, if any."""
+    if conn:
+        conn.close()
+    if temp_db and os.path.exists(temp_db.name):
+        os.unlink(temp_db.name)
 
 
 def format_cookie_line(host, path, is_secure, expiry, name, value, is_http_only):
@@ -107,24 +155,17 @@ def format_cookie_line(host, path, is_secure, expiry, name, value, is_http_only)
     - name: The name of the cookie
     - value: The value of the cookie
     """
-    # Determine if domain flag should be TRUE (subdomain access) or FALSE (exact host)
-    # If host starts with '.', it's a domain cookie (TRUE), otherwise FALSE
-    domain_flag = "TRUE" if host.startswith('.') else "FALSE"
-    
-    # Ensure host starts with a dot for domain cookies
-    if domain_flag == "TRUE" and not host.startswith('.'):
-        domain = '.' + host
-    else:
-        domain = host
-    
-    # Convert secure flag
-    secure_flag = "TRUE" if is_secure else "FALSE"
-    
-    # Convert expiry (already a Unix timestamp in Firefox)
-    expiration = int(expiry) if expiry else 0
-    
-    # Format: domain \t flag \t path \t secure \t expiration \t name \t value
-    return f"{domain}\t{domain_flag}\t{path}\t{secure_flag}\t{expiration}\t{name}\t{value}"
+    # Domain cookies (host starting with '.') are accessible from subdomains
+    return "\t".join((
+        host,
+        BOOL_FLAGS[host.startswith('.')],
+        path,
+        BOOL_FLAGS[bool(is_secure)],
+        # Expiry is already a Unix timestamp in Firefox
+        str(int(expiry)) if expiry else "0",
+        name,
+        value,
+    ))
 
 
 def extract_cookies(output_file=None):
@@ -138,23 +179,24 @@ def extract_cookies(output_file=None):
     
     print("Reading cookies from database...")
     cookies = get_cookies_from_database(profile_path)
-    print(f"Found {len(cookies)} cookies")
     
     print(f"Writing cookies to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f:
+    # Use a large buffer so lines accumulate in memory instead of being
+    # flushed to disk every few kilobytes
+    with open(output_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
         # Write Netscape cookie file header
         f.write("# Netscape HTTP Cookie File\n")
         f.write("# This is a generated file! Do not edit.\n")
         f.write(f"# Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write("\n")
         
-        # Write each cookie
+        # Write each cookie as it is read from the database
+        count = 0
         for cookie in cookies:
-            host, path, is_secure, expiry, name, value, is_http_only = cookie
-            line = format_cookie_line(host, path, is_secure, expiry, name, value, is_http_only)
-            f.write(line + "\n")
+            f.write(format_cookie_line(*cookie) + "\n")
+            count += 1
     
-    print(f"Successfully exported {len(cookies)} cookies to {output_file}")
+    print(f"Successfully exported {count} cookies to {output_file}")
     return output_file
 
 
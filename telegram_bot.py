@@ -5,6 +5,7 @@ Telegram bot that listens for links from the owner and calls nostr_media_uploade
 
 import os
 import re
+import json
 import sys
 import subprocess
 import asyncio
@@ -14,18 +15,25 @@ import argparse
 import tempfile
 import signal
 import time
+import random
+import functools
 try:
     import psutil
     PSUTIL_AVAILABLE = True
 except ImportError:
     PSUTIL_AVAILABLE = False
+# Use the libyaml-backed loader when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlSafeLoader
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader
 from pathlib import Path
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 from typing import Dict, List, Optional
 from urllib.parse import urlparse
 from telegram import Update
 from telegram.ext import Application, MessageHandler, filters, ContextTypes
-from telegram.error import TimedOut, NetworkError
+from telegram.error import TimedOut, NetworkError, RetryAfter
 
 
 # Configure logging
@@ -42,16 +50,31 @@ CONFIG_FILE = os.getenv('TELEGRAM_BOT_CONFIG', 'telegram_bot.yaml')
 IS_CYGWIN = sys.platform == 'cygwin'
 
 # Media group handling: store pending media groups
-# Format: {media_group_id: {'messages': [messages], 'task': asyncio.Task, 'processed': bool}}
+# Format: {media_group_id: {'messages': [messages], 'task': asyncio.Task, 'deadline': float, 'processed': bool}}
+# 'deadline' is the event loop time at which the group is processed; each new message pushes it back
 pending_media_groups: Dict[str, Dict] = {}
 
 # Split media group handling: track groups that might be split across multiple media_group_ids
-# Format: {(chat_id, caption_hash): {'groups': [{'media_group_id': str, 'messages': [messages]}], 'task': asyncio.Task, 'processed': bool, 'channel_config': dict}}
+# Format: {(chat_id, caption_hash): {'groups': [{'media_group_id': str, 'messages': [messages]}], 'task': asyncio.Task, 'deadline': float, 'processed': bool, 'channel_config': dict}}
 pending_split_groups: Dict[tuple, Dict] = {}
 
 # Timeout for waiting for more messages in a media group (in seconds)
 MEDIA_GROUP_TIMEOUT = 2.0
 
+# File extensions for the MIME types Telegram reports for media files
+MIME_TO_EXTENSION = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'video/mp4': 'mp4',
+    'video/quicktime': 'mov',
+    'video/x-msvideo': 'avi',
+}
+
+# Maximum number of files of a media group downloaded from Telegram at the same time
+MAX_CONCURRENT_DOWNLOADS = 4
+
 # Timeout for waiting for additional split groups with the same caption (in seconds)
 SPLIT_GROUP_TIMEOUT = 3.0
 
@@ -59,19 +82,168 @@ SPLIT_GROUP_TIMEOUT = 3.0
 # Format: {pid: {'process': subprocess.Process, 'cmd': list}}
 running_processes: Dict[int, Dict] = {}
 
-# Track running processes for cleanup on shutdown
-# Format: {pid: {'process': subprocess.Process, 'cmd': list, 'started': timestamp}}
-running_processes: Dict[int, Dict] = {}
+# Cygwin PID lookups reuse the last `ps -W` listing for this long (in seconds)
+CYGWIN_PID_MAP_TTL = 0.5
+
+# Last `ps -W` listing: (time.monotonic() timestamp, {windows_pid: cygwin_pid})
+cygwin_pid_map_cache: Optional[tuple] = None
+
+# Duration settings such as script_timeout: a number with an optional unit
+DURATION_PATTERN = re.compile(r'(\d+(?:\.\d*)?|\.\d+)\s*([smh]?)', re.IGNORECASE)
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600}
+
+# Parsed configuration files, keyed by path: {path: (mtime_ns, size, config_data)}
+# Lets /reload skip parsing when the file has not changed
+config_cache: "OrderedDict[str, tuple]" = OrderedDict()
+CONFIG_CACHE_SIZE = 16
+
+# Telegram has a 4096 character limit per message, so error output shown to the
+# user is limited to ~3500 characters to leave room for the prefix
+MAX_ERROR_LENGTH = 3500
+
+# Maximum number of bytes kept from each script output stream (stdout/stderr).
+# Only the tail is kept: the event ID and errors are printed at the end
+MAX_CAPTURED_OUTPUT_BYTES = 1 << 20
+# Size of each read from the script output pipes
+OUTPUT_READ_CHUNK_SIZE = 65536
+# Time allowed for draining the script output pipes after a force kill (in seconds)
+REMAINING_OUTPUT_TIMEOUT = 2.0
+# Maximum number of characters of script output logged when a request fails
+MAX_LOGGED_OUTPUT_CHARS = 65536
 
 # URL regex pattern to match http/https links
+# Runs until whitespace, quotes or angle brackets; parentheses are only included
+# when balanced, so "(see https://example.com)" does not capture the ")".
+# Written as an unrolled loop (runs of plain characters, then "(...)" groups)
+# instead of a per-character alternation, so it matches in one linear pass;
+# the lookahead requires at least one character after the scheme
 URL_PATTERN = re.compile(
-    r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+    r'https?://(?=[^\s<>"\'()]|\([^\s<>"\'()]*\))'
+    r'[^\s<>"\'()]*(?:\([^\s<>"\'()]*\)[^\s<>"\'()]*)*'
 )
 
+# Bech32 alphabet used for NIP-19 encoding (nevent, note, npub, ...)
+BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+
+# Letters that can start a Windows drive prefix (e.g. "C:")
+DRIVE_LETTERS = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz')
+
+# Number of path conversions (cygpath results and manual conversions) kept in memory
+CYGWIN_PATH_CACHE_SIZE = 64
+
+# Patterns used by extract_event_id. Each one starts with a literal so the regex
+# engine can skip quickly through large outputs; they are only run when needed.
+# Links in the output (hex strings inside them are file hashes, not event IDs)
+OUTPUT_URL_PATTERN = re.compile(r'https?://[^\s)]+')
+# "id": "<hex>" fields from JSON events printed by nak
+JSON_ID_PATTERN = re.compile(r'"id"\s*:\s*"([0-9a-fA-F]{64})"')
+# Success messages (matched against lowercased output); the event ID is usually
+# on the following line. Each alternative is a named group so matches can be
+# tried in SUCCESS_MARKERS priority order rather than by position
+SUCCESS_PATTERN = re.compile(
+    r'(?P<successfully>successfully published)'
+    r'|(?P<published>published(?=[^\n]*event))'
+    r'|(?P<created>event(?=[^\n]*created))'
+)
+SUCCESS_MARKERS = ('successfully', 'published', 'created')
+SUCCESS_PATTERN_IGNORECASE = re.compile(SUCCESS_PATTERN.pattern, re.IGNORECASE)
+# Any 64-char hex string (used to collect file hashes from URLs)
+HEX64_PATTERN = re.compile(r'[0-9a-fA-F]{64}')
+# Standalone 64-char hex string
+HEX64_WORD_PATTERN = re.compile(r'\b[0-9a-fA-F]{64}\b')
+
+# nak prints the event ID near the end, so bare hex strings are only searched
+# for in this many trailing characters / lines of output
+EVENT_ID_TAIL_CHARS = 4096
+EVENT_ID_TAIL_LINES = 30
+
+# Patterns used by sanitize_subprocess_output (\x1b, \033 and \u001b are all ESC)
+# CSI (Control Sequence Introducer) sequences: \x1b[...m, \x1b[2J, \x1b[H, etc.
+ANSI_CSI_PATTERN = re.compile(r'\x1b\[[0-9;?]*[a-zA-Z@_!]')
+# OSC (Operating System Command) sequences: \x1b]...\x07 or \x1b]...\x1b\\
+ANSI_OSC_PATTERN = re.compile(r'\x1b\][^\x07\x1b]*(\x07|\x1b\\)')
+# DCS (Device Control String), PM (Privacy Message) and APC (Application Program Command)
+ANSI_DCS_PATTERN = re.compile(r'\x1bP[^\x1b]*\x1b\\')
+ANSI_PM_PATTERN = re.compile(r'\x1b\^[^\x1b]*\x1b\\')
+ANSI_APC_PATTERN = re.compile(r'\x1b_[^\x1b]*\x1b\\')
+# Single-character ESC sequences (VT100/ANSI control functions), e.g. \x1bD (IND), \x1bM (RI)
+ANSI_ESC_SINGLE_PATTERN = re.compile(r'\x1b[DdEeHhMNOPSTUVXZ78=<>]')
+ANSI_ESC_KEYPAD_PATTERN = re.compile(r'\x1b[>=]')
+# C0 control characters except tab and newline, plus DEL
+CONTROL_CHARS = [i for i in range(32) if i not in (9, 10)] + [127]
+CONTROL_CHARS_PATTERN = re.compile('[' + re.escape(''.join(map(chr, CONTROL_CHARS))) + ']')
+# str.translate table deleting the same characters; faster than the regex on
+# ASCII-only text, but much slower once the text has other characters
+CONTROL_CHARS_TABLE = dict.fromkeys(CONTROL_CHARS)
+# More than 2 consecutive newlines
+EXCESS_NEWLINES_PATTERN = re.compile(r'\n{3,}')
+
+def read_config_file(config_path):
+    """Parse a configuration file, reusing the previous result if it is unchanged.
+    
+    Cached entries are validated against the file's mtime and size, and a copy
+    is returned so callers can't modify the cached data.
+    
+    Args:
+        config_path: Path to the YAML (or .json) configuration file
+    
+    Returns:
+        Parsed configuration data
+    """
+    st = os.stat(config_path)
+    cached = config_cache.get(config_path)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        config_cache.move_to_end(config_path)
+        return _copy_config_data(cached[2])
+    
+    # Read as bytes: both parsers detect the encoding themselves (UTF-8 by default)
+    with open(config_path, 'rb') as f:
+        if config_path.lower().endswith('.json'):
+            config_data = json.load(f)
+        else:
+            config_data = yaml.load(f, Loader=YamlSafeLoader)
+    
+    config_cache[config_path] = (st.st_mtime_ns, st.st_size, config_data)
+    config_cache.move_to_end(config_path)
+    if len(config_cache) > CONFIG_CACHE_SIZE:
+        config_cache.popitem(last=False)
+    return _copy_config_data(config_data)
+
+
+def _copy_config(value):
+    """Copy a config dict or list one level deep (scalars are immutable and shared)."""
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+def _copy_config_data(config_data):
+    """Copy parsed configuration data without copy.deepcopy.
+    
+    The configuration is at most two levels of containers (settings and
+    channels -> channel settings), so only those levels are copied.
+    """
+    if not isinstance(config_data, dict):
+        return config_data
+    
+    data = {key: _copy_config(value) for key, value in config_data.items()}
+    channels = data.get('channels')
+    if isinstance(channels, dict):
+        data['channels'] = {
+            name: {key: _copy_config(value) for key, value in channel.items()} if isinstance(channel, dict) else channel
+            for name, channel in channels.items()
+        }
+    return data
+
 
 def load_config(config_path, use_firefox=True, cookies_file=None):
     """Load configuration from YAML file.
     
+    Files ending in .json are parsed with the json module instead, which is
+    much faster than the YAML parser and accepts the same structure.
+    
     Expected structure:
     bot_token: YOUR_BOT_TOKEN
     owner_id: YOUR_USER_ID
@@ -89,8 +261,7 @@ def load_config(config_path, use_firefox=True, cookies_file=None):
         logger.error(f"Configuration file not found: {config_path}")
         raise FileNotFoundError(f"Configuration file not found: {config_path}")
     
-    with open(config_path, 'r', encoding='utf-8') as f:
-        config_data = yaml.safe_load(f)
+    config_data = read_config_file(config_path)
     
     if not config_data:
         raise ValueError("Configuration file is empty or invalid")
@@ -113,21 +284,16 @@ def load_config(config_path, use_firefox=True, cookies_file=None):
         # Don't raise error, just log warning - user might fix it later
     
     # Get script timeout (default: 6 minutes = 360 seconds)
-    script_timeout = config_data.get('script_timeout', 360)
-    # Convert to int if it's a number
-    if isinstance(script_timeout, (int, float)):
-        script_timeout = int(script_timeout)
-    elif isinstance(script_timeout, str):
-        # Support format like "6m" or "360s"
-        script_timeout_str = script_timeout.lower().strip()
-        if script_timeout_str.endswith('m'):
-            script_timeout = int(float(script_timeout_str[:-1]) * 60)
-        elif script_timeout_str.endswith('s'):
-            script_timeout = int(float(script_timeout_str[:-1]))
-        else:
-            script_timeout = int(float(script_timeout_str))
-    else:
-        script_timeout = 360  # Default fallback
+    script_timeout = parse_duration(config_data.get('script_timeout', 360), default=360)
+    
+    # Maximum number of scripts running at once (default: number of CPUs)
+    max_concurrent_scripts = max(1, int(config_data.get('max_concurrent_scripts') or os.cpu_count() or 4))
+    
+    channels = config_data.get('channels', {})
+    # Normalize cookie-disabling domains once instead of on every request
+    for channel_config in channels.values():
+        if isinstance(channel_config, dict) and channel_config.get('disable_cookies_for_sites'):
+            channel_config['disable_cookies_for_sites'] = normalize_site_patterns(channel_config['disable_cookies_for_sites'])
     
     return {
         'bot_token': config_data.get('bot_token'),
@@ -135,53 +301,148 @@ def load_config(config_path, use_firefox=True, cookies_file=None):
         'script_path': config_data.get('script_path', './nostr_media_uploader.sh'),
         'cygwin_root': config_data.get('cygwin_root'),  # Optional: path to Cygwin installation
         'nostr_client_url': config_data.get('nostr_client_url'),  # Optional: URL template for nostr client links
-        'channels': config_data.get('channels', {}),
+        'nostr_client_url_template': build_client_url_template(config_data.get('nostr_client_url')),
+        'channels': channels,
+        'channel_index': build_channel_index(channels),  # Lookup table used by find_channel_config
+        'channels_summary': build_channels_summary(channels),  # Preformatted channel list for logging
         'use_firefox': use_firefox,
         'cookies_file': cookies_file,
-        'disable_cookies_for_sites': config_data.get('disable_cookies_for_sites'),  # Optional: list of domains to disable cookies for
+        'disable_cookies_for_sites': normalize_site_patterns(config_data.get('disable_cookies_for_sites')),  # Optional: list of domains to disable cookies for
         'script_timeout': script_timeout,  # Timeout for script execution in seconds (default: 360 = 6 minutes)
+        'max_concurrent_scripts': max_concurrent_scripts,  # Limit on scripts running at the same time
     }
 
 
-def find_channel_config(config, chat_id=None, chat_username=None):
-    """Find channel configuration matching the given chat_id or username.
+def parse_duration(value, default):
+    """Parse a duration setting into whole seconds.
     
-    Returns the channel config dict if found, None otherwise.
+    Args:
+        value: Number of seconds, or a string with an optional unit
+            (e.g. "360", "360s", "6m", "6 m", "1.5h")
+        default: Value used when the setting is neither a number nor a string
+    
+    Returns:
+        Duration in seconds
+    
+    Raises:
+        ValueError: If a string value is not a valid duration
     """
-    channels = config.get('channels', {})
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str):
+        return default
+    match = DURATION_PATTERN.fullmatch(value.strip())
+    if not match:
+        raise ValueError(f"Invalid duration: {value!r} (expected e.g. 360, \"360s\", \"6m\" or \"1h\")")
+    return int(float(match.group(1)) * DURATION_UNITS[match.group(2).lower()])
+
+
+def build_client_url_template(nostr_client_url):
+    """Turn the nostr_client_url setting into a str.format template taking {nevent}.
     
-    if not chat_id and not chat_username:
+    Common formats: https://snort.social/e/{nevent} or https://primal.net/e/{nevent}.
+    If the URL has no {nevent} placeholder, /e/<nevent> is appended to it.
+    
+    Args:
+        nostr_client_url: Configured client URL, or None
+    
+    Returns:
+        Format template, or None if no client URL is configured
+    """
+    if not nostr_client_url:
         return None
+    if '{nevent}' in nostr_client_url:
+        return nostr_client_url
+    # Escape braces so the URL is used literally
+    base_url = nostr_client_url.replace('{', '{{').replace('}', '}}')
+    if nostr_client_url.endswith('/'):
+        return base_url + 'e/{nevent}'
+    return base_url + '/e/{nevent}'
+
+
+def build_channel_index(channels):
+    """Build the lookup table used by find_channel_config.
     
-    chat_id_str = str(chat_id) if chat_id else None
-    chat_username_str = chat_username.lstrip('@') if chat_username else None
+    Args:
+        channels: Channels dict from the configuration
     
-    # Search through channels for a match
-    for channel_name, channel_config in channels.items():
+    Returns:
+        Dict mapping each channel's chat_id (without leading '@') to a tuple of
+        (position, channel_name, channel_config). The first channel wins if
+        several share the same chat_id.
+    """
+    channel_index = {}
+    for position, (channel_name, channel_config) in enumerate(channels.items()):
+        # Skip empty or malformed entries (e.g. a channel name with no settings)
+        if not isinstance(channel_config, dict):
+            continue
         channel_chat_id = channel_config.get('chat_id')
         if not channel_chat_id:
             continue
-        
-        channel_chat_id_str = str(channel_chat_id).lstrip('@')
-        
-        # Match by numeric ID
-        if chat_id_str and chat_id_str == channel_chat_id_str:
-            logger.debug(f"Found channel config '{channel_name}' for chat_id={chat_id_str}")
-            return channel_config
-        
-        # Match by username
-        if chat_username_str and chat_username_str == channel_chat_id_str:
-            logger.debug(f"Found channel config '{channel_name}' for username={chat_username_str}")
-            return channel_config
+        channel_index.setdefault(str(channel_chat_id).lstrip('@'), (position, channel_name, channel_config))
+    return channel_index
+
+
+def build_channels_summary(channels):
+    """Format the per-channel lines logged at startup.
+    
+    Args:
+        channels: Channels dict from the configuration
+    
+    Returns:
+        One "  - name: chat_id=..., profile_name=..." line per channel, joined with newlines
+    """
+    return "\n".join(
+        f"  - {channel_name}: chat_id={channel_config.get('chat_id', 'N/A')}, profile_name={channel_config.get('profile_name', 'N/A')}"
+        for channel_name, channel_config in channels.items()
+        if isinstance(channel_config, dict)
+    )
+
+
+def find_channel_config(config, chat_id=None, chat_username=None):
+    """Find channel configuration matching the given chat_id or username.
+    
+    Returns the channel config dict if found, None otherwise.
+    """
+    if not chat_id and not chat_username:
+        return None
+    
+    channel_index = config.get('channel_index')
+    if channel_index is None:
+        channel_index = build_channel_index(config.get('channels', {}))
+    
+    id_match = channel_index.get(str(chat_id)) if chat_id else None
+    username_match = channel_index.get(chat_username.lstrip('@')) if chat_username else None
+    
+    # If both match different channels, the one listed first in the config wins
+    if id_match and (not username_match or id_match[0] <= username_match[0]):
+        logger.debug(f"Found channel config '{id_match[1]}' for chat_id={chat_id}")
+        return id_match[2]
+    if username_match:
+        logger.debug(f"Found channel config '{username_match[1]}' for username={chat_username.lstrip('@')}")
+        return username_match[2]
     
     return None
 
 
-def extract_urls(text):
-    """Extract all URLs from a text message."""
-    if not text:
-        return []
-    return URL_PATTERN.findall(text)
+def normalize_site_patterns(patterns):
+    """Normalize a disable_cookies_for_sites setting for should_disable_cookies.
+    
+    Args:
+        patterns: Domain pattern or list of domain patterns (e.g., ['facebook.com', '.instagram.com'])
+    
+    Returns:
+        Frozenset of lowercase patterns without surrounding whitespace or dots;
+        empty entries are dropped
+    """
+    if not patterns:
+        return frozenset()
+    
+    # Convert to list if it's not already
+    if not isinstance(patterns, (list, tuple, frozenset)):
+        patterns = [patterns]
+    
+    return frozenset(p.lower().strip().strip('.') for p in patterns if p and p.strip())
 
 
 def should_disable_cookies(urls, disable_cookies_for_sites):
@@ -189,7 +450,8 @@ def should_disable_cookies(urls, disable_cookies_for_sites):
     
     Args:
         urls: List of URLs to check
-        disable_cookies_for_sites: List of domain patterns to match against (e.g., ['facebook.com', 'instagram.com'])
+        disable_cookies_for_sites: Frozenset of domain patterns from normalize_site_patterns
+            (e.g., {'facebook.com', 'instagram.com'}); a raw list is normalized first
     
     Returns:
         True if any URL matches a domain in the disable list, False otherwise
@@ -197,16 +459,9 @@ def should_disable_cookies(urls, disable_cookies_for_sites):
     if not urls:
         return False
     
-    # If disable_cookies_for_sites is None or empty list, don't disable
-    if not disable_cookies_for_sites:
-        return False
-    
-    # Convert to list if it's not already
-    if not isinstance(disable_cookies_for_sites, list):
-        disable_cookies_for_sites = [disable_cookies_for_sites]
-    
-    # Filter out empty strings
-    disable_cookies_for_sites = [p for p in disable_cookies_for_sites if p and p.strip()]
+    # Configs from load_config are already normalized
+    if not isinstance(disable_cookies_for_sites, frozenset):
+        disable_cookies_for_sites = normalize_site_patterns(disable_cookies_for_sites)
     
     # If list is empty after filtering, don't disable
     if not disable_cookies_for_sites:
@@ -223,39 +478,66 @@ def should_disable_cookies(urls, disable_cookies_for_sites):
             parsed = urlparse(url)
             domain = parsed.netloc.lower()
             # Remove port if present
-            if ':' in domain:
-                domain = domain.split(':')[0]
+            domain = domain.partition(':')[0]
         except Exception:
             # If parsing fails, try simple string matching
             domain = url.lower()
         
-        # Check if domain matches any pattern in the disable list
-        for pattern in disable_cookies_for_sites:
-            pattern_lower = pattern.lower().strip()
-            # Remove leading/trailing dots and whitespace
-            pattern_lower = pattern_lower.strip('.')
-            
-            # Check if domain matches pattern (exact match or ends with pattern)
-            if domain == pattern_lower or domain.endswith('.' + pattern_lower):
-                logger.info(f"URL {url} matches disable cookies pattern '{pattern}', disabling cookies")
+        # Check if domain matches any pattern in the disable list (exact match or
+        # subdomain): look up the domain and each parent domain in the set, so the
+        # cost depends on the number of labels, not on the number of patterns
+        candidate = domain
+        while True:
+            if candidate in disable_cookies_for_sites:
+                logger.info(f"URL {url} matches disable cookies pattern '{candidate}', disabling cookies")
                 return True
+            _, dot, candidate = candidate.partition('.')
+            if not dot:
+                break
     
     return False
 
 
-def extract_extra_text(text, urls):
-    """Extract text remaining after URLs are removed."""
+def split_urls_and_text(text):
+    """Extract URLs and the text remaining after they are removed, in one regex pass.
+    
+    Args:
+        text: Message text
+    
+    Returns:
+        Tuple of (urls, extra_text)
+    """
     if not text:
-        return ""
+        return [], ""
     
-    # Remove all URLs from text
-    text_without_urls = text
-    for url in urls:
-        text_without_urls = text_without_urls.replace(url, '', 1)
+    # Cheap substring check skips the regex for messages without links
+    if 'http' not in text:
+        return [], ' '.join(text.split())
+    
+    urls = []
+    parts = []
+    last_end = 0
+    for match in URL_PATTERN.finditer(text):
+        urls.append(match.group())
+        parts.append(text[last_end:match.start()])
+        last_end = match.end()
+    parts.append(text[last_end:])
     
-    # Clean up extra whitespace
-    extra_text = ' '.join(text_without_urls.split()).strip()
-    return extra_text
+    # URLs are replaced with a space, so words around a URL stay separated;
+    # split() also drops leading/trailing whitespace
+    return urls, ' '.join(' '.join(parts).split())
+
+
+def _remove_repeatedly(pattern, text, passes):
+    """Remove matches of pattern from text, up to passes times.
+    
+    Stops early once a pass removes nothing, since later passes would not either.
+    """
+    for _ in range(passes):
+        text, count = pattern.subn('', text)
+        if not count:
+            break
+    return text
 
 
 def sanitize_subprocess_output(text):
@@ -285,47 +567,36 @@ def sanitize_subprocess_output(text):
     
     # Remove all ANSI/VT100 escape sequences that terminals interpret as commands
     # This is comprehensive to prevent any terminal command injection
-    
-    # 1. CSI (Control Sequence Introducer) sequences: \x1b[...m, \x1b[2J, \x1b[H, etc.
-    # Matches: \x1b[ followed by optional parameters and a command character
-    text = re.sub(r'\x1b\[[0-9;?]*[a-zA-Z@_!]', '', text)  # CSI sequences with various endings
-    text = re.sub(r'\033\[[0-9;?]*[a-zA-Z@_!]', '', text)  # \033[...letter
-    text = re.sub(r'\u001b\[[0-9;?]*[a-zA-Z@_!]', '', text)  # Unicode escape
-    
-    # 2. OSC (Operating System Command) sequences: \x1b]...\x07 or \x1b]...\x1b\\
-    # Can be used for terminal window title, clipboard manipulation, etc.
-    text = re.sub(r'\x1b\][^\x07\x1b]*(\x07|\x1b\\)', '', text)  # OSC sequences
-    text = re.sub(r'\033\][^\x07\x1b]*(\x07|\033\\)', '', text)  # \033 variant
-    
-    # 3. DCS (Device Control String): \x1bP...\x1b\\
-    # Can send commands to terminal devices
-    text = re.sub(r'\x1bP[^\x1b]*\x1b\\', '', text)  # DCS sequences
-    text = re.sub(r'\033P[^\033]*\033\\', '', text)  # \033 variant
-    
-    # 4. PM (Privacy Message): \x1b^...\x1b\\
-    text = re.sub(r'\x1b\^[^\x1b]*\x1b\\', '', text)  # PM sequences
-    text = re.sub(r'\033\^[^\033]*\033\\', '', text)  # \033 variant
-    
-    # 5. APC (Application Program Command): \x1b_...\x1b\\
-    text = re.sub(r'\x1b_[^\x1b]*\x1b\\', '', text)  # APC sequences
-    text = re.sub(r'\033_[^\033]*\033\\', '', text)  # \033 variant
-    
-    # 6. Single-character ESC sequences (VT100/ANSI control functions)
-    # These are ESC followed by a single character (no brackets)
-    # Examples: \x1bD (IND), \x1bE (NEL), \x1bH (HTS), \x1bM (RI), etc.
-    esc_single_chars = r'[DdEeHhMNOPSTUVXZ78=<>]'  # Common single-char ESC sequences
-    text = re.sub(r'\x1b' + esc_single_chars, '', text)
-    text = re.sub(r'\033' + esc_single_chars, '', text)
-    text = re.sub(r'\u001b' + esc_single_chars, '', text)
-    
-    # 7. ESC > and ESC = (already handled above, but be explicit)
-    text = re.sub(r'\x1b[>=]', '', text)
-    text = re.sub(r'\033[>=]', '', text)
-    
-    # 8. Remove any remaining isolated ESC characters (escape sequences we might have missed)
-    # This is a catch-all for any ESC not followed by valid sequence characters
-    # But we need to be careful not to remove legitimate content
-    # We'll remove standalone ESC that aren't part of sequences
+    # Every sequence starts with ESC, so output without one skips these passes
+    if '\x1b' in text:
+        # Each pass below is applied up to as many times as before the patterns were
+        # merged: a later pass also removes sequences exposed by an earlier removal
+        
+        # 1. CSI (Control Sequence Introducer) sequences: \x1b[...m, \x1b[2J, \x1b[H, etc.
+        # Matches: \x1b[ followed by optional parameters and a command character
+        text = _remove_repeatedly(ANSI_CSI_PATTERN, text, 3)
+        
+        # 2. OSC (Operating System Command) sequences: \x1b]...\x07 or \x1b]...\x1b\\
+        # Can be used for terminal window title, clipboard manipulation, etc.
+        text = _remove_repeatedly(ANSI_OSC_PATTERN, text, 2)
+        
+        # 3. DCS (Device Control String): \x1bP...\x1b\\
+        # Can send commands to terminal devices
+        text = _remove_repeatedly(ANSI_DCS_PATTERN, text, 2)
+        
+        # 4. PM (Privacy Message): \x1b^...\x1b\\
+        text = _remove_repeatedly(ANSI_PM_PATTERN, text, 2)
+        
+        # 5. APC (Application Program Command): \x1b_...\x1b\\
+        text = _remove_repeatedly(ANSI_APC_PATTERN, text, 2)
+        
+        # 6. Single-character ESC sequences (VT100/ANSI control functions)
+        # These are ESC followed by a single character (no brackets)
+        # Examples: \x1bD (IND), \x1bE (NEL), \x1bH (HTS), \x1bM (RI), etc.
+        text = _remove_repeatedly(ANSI_ESC_SINGLE_PATTERN, text, 3)
+        
+        # 7. ESC > and ESC = (already handled above, but be explicit)
+        text = _remove_repeatedly(ANSI_ESC_KEYPAD_PATTERN, text, 2)
     
     # Aggressively remove ALL carriage returns - they cause overwriting in terminals
     # Even \r\n sequences can cause issues in some terminal emulators
@@ -337,43 +608,15 @@ def sanitize_subprocess_output(text):
     # Keep: \n (newline 10), \t (tab 9)
     # Remove all other C0 control characters (0-31) and DEL (127)
     # These can be interpreted as terminal commands or cause display issues
-    control_chars = []
-    for i in range(32):
-        if i not in (9, 10):  # Keep tab (9) and newline (10)
-            control_chars.append(chr(i))
-    
-    # Also remove DEL (127) - can cause backspace-like behavior
-    control_chars.append(chr(127))
-    
-    # Build regex to remove these control chars
-    if control_chars:
-        control_pattern = '[' + re.escape(''.join(control_chars)) + ']'
-        text = re.sub(control_pattern, '', text)
-    
-    # Remove null bytes (can terminate strings unexpectedly)
-    text = text.replace('\x00', '')
-    
-    # Remove backspace characters and their effects (can cause text deletion in terminals)
-    # Backspace (\x08) followed by any character should remove both
-    while '\x08' in text:
-        text = re.sub(r'.\x08', '', text)  # Remove char + backspace
-        text = text.replace('\x08', '')  # Remove any remaining backspaces
-    
-    # Remove form feed (\x0c) - can cause page breaks/clearing in terminals
-    text = text.replace('\x0c', '\n')
-    
-    # Remove vertical tab (\x0b) - can cause cursor movement
-    text = text.replace('\x0b', '\n')
-    
-    # Remove any remaining ESC characters (standalone escape chars that might have been missed)
-    # This is a safety measure - remove any ESC not already part of a removed sequence
-    # But we do this after removing sequences to avoid interfering with sequence matching
-    text = text.replace('\x1b', '')
-    text = text.replace('\033', '')
-    text = text.replace('\u001b', '')
+    # This also drops null bytes, backspaces, form feeds, vertical tabs and any
+    # ESC left over from sequences not matched above
+    if text.isascii():
+        text = text.translate(CONTROL_CHARS_TABLE)
+    else:
+        text = CONTROL_CHARS_PATTERN.sub('', text)
     
     # Normalize excessive whitespace (more than 2 consecutive newlines -> 2 newlines)
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = EXCESS_NEWLINES_PATTERN.sub('\n\n', text)
     
     # Remove trailing whitespace from each line (but keep the line itself)
     lines = text.split('\n')
@@ -390,6 +633,63 @@ def sanitize_subprocess_output(text):
     return text
 
 
+def find_json_event_id(output):
+    """Find the id of the last Nostr event printed as a JSON line.
+    
+    Only lines containing "kind" are parsed, walking backwards from the end
+    of the output. A line counts as an event if it is a JSON object with an
+    integer kind and a 64-char hex id.
+    
+    Args:
+        output: Script output
+    
+    Returns:
+        Event ID (hex) or None if no JSON event line is found
+    """
+    end = len(output)
+    while True:
+        kind_pos = output.rfind('"kind"', 0, end)
+        if kind_pos == -1:
+            return None
+        line_start = output.rfind('\n', 0, kind_pos) + 1
+        line_end = output.find('\n', kind_pos)
+        if line_end == -1:
+            line_end = len(output)
+        end = line_start
+        
+        line = output[line_start:line_end].strip()
+        if not line.startswith('{'):
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if not isinstance(event, dict) or type(event.get('kind')) is not int:
+            continue
+        event_id = event.get('id')
+        if isinstance(event_id, str) and HEX64_PATTERN.fullmatch(event_id):
+            return event_id
+
+
+def _is_url_hex(output, hex_id):
+    """Check whether hex_id is one of the hex strings found in links in output.
+    
+    Same result as collecting the hex strings of every link, but only the lines
+    where hex_id occurs are searched. Links never span lines.
+    """
+    pos = output.find(hex_id)
+    while pos != -1:
+        line_start = output.rfind('\n', 0, pos) + 1
+        line_end = output.find('\n', pos)
+        if line_end == -1:
+            line_end = len(output)
+        for url in OUTPUT_URL_PATTERN.findall(output, line_start, line_end):
+            if hex_id in HEX64_PATTERN.findall(url):
+                return True
+        pos = output.find(hex_id, line_end)
+    return False
+
+
 def extract_event_id(output):
     """Extract event ID from nak output.
     
@@ -399,83 +699,173 @@ def extract_event_id(output):
     The event ID is typically output by nak in JSON format or as a standalone hex string.
     We should exclude hex strings that appear in URLs (like blossom file hashes).
     """
-    # First, collect all hex strings that appear in URLs to exclude them
-    url_hex = set()
-    for url_match in re.finditer(r'https?://[^\s\)]+', output):
-        url = url_match.group(0)
-        # Extract hex strings from URLs (these are file hashes, not event IDs)
-        url_hex.update(re.findall(r'([0-9a-fA-F]{64})', url))
-    
-    # nak might output JSON with the event - look for complete JSON objects
-    # Try to find JSON objects that contain "id", "kind", "pubkey" (event structure)
-    json_object_pattern = r'\{[^{}]*"id"\s*:\s*"([0-9a-fA-F]{64})"[^{}]*"kind"\s*:\s*\d+[^{}]*\}'
-    json_matches = re.findall(json_object_pattern, output, re.DOTALL)
-    if json_matches:
-        # Return the last JSON match (most likely the event from nak)
-        event_id = json_matches[-1]
-        if event_id not in url_hex:
-            return event_id
+    if not output:
+        return None
     
-    # Look for JSON with "id" field - nak might output just the event ID in JSON
-    json_id_patterns = [
-        r'\{\s*"id"\s*:\s*"([0-9a-fA-F]{64})"',  # JSON starting with id
-        r'"id"\s*:\s*"([0-9a-fA-F]{64})"',  # JSON id field (but not in URLs)
-    ]
+    has_urls = 'http' in output
     
-    for pattern in json_id_patterns:
-        matches = re.findall(pattern, output)
-        if matches:
-            # Return the last match that's not in a URL
-            for event_id in reversed(matches):
-                if event_id not in url_hex:
-                    return event_id
-    
-    # Look for event ID after "Successfully published" or similar success messages
-    # nak might output the event ID on a line after success message
-    success_patterns = [
-        r'Successfully published[^\n]*\n[^\n]*([0-9a-fA-F]{64})',
-        r'published[^\n]*event[^\n]*\n[^\n]*([0-9a-fA-F]{64})',
-        r'event[^\n]*created[^\n]*\n[^\n]*([0-9a-fA-F]{64})',
-    ]
+    # nak prints the published event as a JSON object on its own line - parse
+    # the last such line and use its id when it really is an event
+    event_id = find_json_event_id(output)
+    if event_id and not (has_urls and _is_url_hex(output, event_id)):
+        return event_id
     
-    for pattern in success_patterns:
-        match = re.search(pattern, output, re.IGNORECASE | re.MULTILINE)
-        if match:
-            event_id = match.group(1)
+    # Collect hex strings that appear in URLs
+    # (cheap substring checks skip regex passes that can't match)
+    url_hex = set()
+    if has_urls:
+        for url in OUTPUT_URL_PATTERN.findall(output):
+            url_hex.update(HEX64_PATTERN.findall(url))
+    
+    # nak might output JSON with the event - return the last "id" that's not in a URL
+    if '"id"' in output:
+        for event_id in reversed(JSON_ID_PATTERN.findall(output)):
             if event_id not in url_hex:
                 return event_id
     
+    # Look for event ID on the line after "Successfully published" or similar success messages,
+    # taking the last hex on the first such line of the highest-priority marker. Lowercasing
+    # is much faster than an ignore-case search, but only keeps offsets valid if the length
+    # is unchanged
+    lowered = output.lower()
+    if 'publish' not in lowered and 'event' not in lowered:
+        success_matches = ()
+    elif len(lowered) == len(output):
+        success_matches = SUCCESS_PATTERN.finditer(lowered)
+    else:
+        success_matches = SUCCESS_PATTERN_IGNORECASE.finditer(output)
+    # Group marker offsets by kind so that, like separate searches per marker, a generic
+    # "published ... event" line never wins over a later "successfully published" one
+    marker_ends = {marker: [] for marker in SUCCESS_MARKERS}
+    for match in success_matches:
+        marker_ends[match.lastgroup].append(match.end())
+    for marker in SUCCESS_MARKERS:
+        for marker_end in marker_ends[marker]:
+            line_end = output.find('\n', marker_end)
+            if line_end == -1:
+                break
+            next_end = output.find('\n', line_end + 1)
+            span_end = next_end if next_end != -1 else len(output)
+            for hex_id in reversed(HEX64_WORD_PATTERN.findall(output, line_end + 1, span_end)):
+                if hex_id not in url_hex:
+                    return hex_id
+    
     # Look for hex strings near the end of output (nak usually outputs event ID at the end)
-    # But exclude common file hashes that appear in URLs
-    lines = output.split('\n')
-    # Check last 30 lines for event ID
-    for line in reversed(lines[-30:]):
+    # Only the tail is searched, starting at a line boundary when possible
+    tail_start = max(0, len(output) - EVENT_ID_TAIL_CHARS)
+    if tail_start:
+        line_end = output.find('\n', tail_start)
+        if line_end != -1:
+            tail_start = line_end + 1
+    tail = output[tail_start:]
+    
+    # Scan the tail for hex strings once, keeping their offsets
+    hex_matches = [(match.start(), match.group()) for match in HEX64_WORD_PATTERN.finditer(tail)]
+    
+    # Offset where the last EVENT_ID_TAIL_LINES lines of the tail begin
+    lines_start = len(tail)
+    for _ in range(EVENT_ID_TAIL_LINES):
+        lines_start = tail.rfind('\n', 0, lines_start)
+        if lines_start == -1:
+            break
+    lines_start += 1
+    
+    # Check last lines for event ID, taking the first hex on the last line without URLs.
+    # Matches are walked backwards one line at a time
+    last = len(hex_matches) - 1
+    while last >= 0 and hex_matches[last][0] >= lines_start:
+        line_start = tail.rfind('\n', 0, hex_matches[last][0]) + 1
+        first = last
+        while first > 0 and hex_matches[first - 1][0] >= line_start:
+            first -= 1
+        line_end = tail.find('\n', hex_matches[last][0])
+        line = tail[line_start:line_end if line_end != -1 else len(tail)]
         # Skip lines that contain URLs
-        if re.search(r'https?://', line):
-            continue
-        hex_matches = re.findall(r'\b([0-9a-fA-F]{64})\b', line)
-        if hex_matches:
-            # Return the first match from this line that's not in URLs
-            for hex_id in hex_matches:
+        if 'http://' not in line and 'https://' not in line:
+            for _, hex_id in hex_matches[first:last + 1]:
                 if hex_id not in url_hex:
                     return hex_id
+        last = first - 1
     
-    # Last resort: look for any 64-char hex string, but exclude ones in URLs
-    all_hex = re.findall(r'\b([0-9a-fA-F]{64})\b', output)
-    if all_hex:
-        # Return the last hex that's not in a URL
-        for hex_id in reversed(all_hex):
-            if hex_id not in url_hex:
-                return hex_id
+    # Last resort: return the last 64-char hex string in the tail that's not in a URL
+    for _, hex_id in reversed(hex_matches):
+        if hex_id not in url_hex:
+            return hex_id
     
     return None
 
 
+def _bech32_polymod(values):
+    """Compute the bech32 checksum polymod (BIP-173)."""
+    generator = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                chk ^= generator[i]
+    return chk
+
+
+def _convert_bits(data, from_bits, to_bits):
+    """Regroup a sequence of from_bits-wide integers into to_bits-wide integers (with padding)."""
+    acc = 0
+    bits = 0
+    result = []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((acc >> bits) & max_value)
+    if bits:
+        result.append((acc << (to_bits - bits)) & max_value)
+    return result
+
+
+def bech32_encode(hrp, data):
+    """Encode bytes as a bech32 string with the given human-readable part.
+    
+    Unlike BIP-173, no 90 character limit is enforced (NIP-19 entities with TLV
+    data can be longer).
+    """
+    values = _convert_bits(data, 8, 5)
+    hrp_expanded = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(hrp_expanded + values + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + '1' + ''.join(BECH32_CHARSET[v] for v in values + checksum)
+
+
+def encode_nevent(event_id_hex):
+    """Encode an event ID as a NIP-19 nevent without relay or author hints.
+    
+    Produces the same output as `nak encode nevent <id>`.
+    
+    Raises:
+        ValueError: If event_id_hex is not a 64-char hex string
+    """
+    event_id = bytes.fromhex(event_id_hex)
+    if len(event_id) != 32:
+        raise ValueError(f"Event ID must be 32 bytes, got {len(event_id)}")
+    # TLV entry 0 (special): the 32-byte event ID
+    return bech32_encode('nevent', bytes((0, 32)) + event_id)
+
+
 async def encode_to_nevent(event_id_hex):
-    """Encode event ID to nevent format using nak command."""
+    """Encode event ID to nevent format.
+    
+    Encodes in-process, falling back to the nak command if that fails.
+    """
     if not event_id_hex or len(event_id_hex) != 64:
         return None
     
+    try:
+        return encode_nevent(event_id_hex)
+    except ValueError as e:
+        logger.warning(f"Failed to encode nevent in-process, falling back to nak: {e}")
+    
     try:
         process = await asyncio.create_subprocess_exec(
             'nak', 'encode', 'nevent', event_id_hex,
@@ -504,8 +894,13 @@ async def encode_to_nevent(event_id_hex):
     return None
 
 
+@functools.lru_cache(maxsize=None)
 def is_cygwin():
-    """Check if running on Cygwin."""
+    """Check if running on Cygwin.
+    
+    The result cannot change while the bot is running, so it is computed once
+    instead of probing the filesystem (and possibly spawning cygpath) per call.
+    """
     try:
         # Check for Cygwin-specific environment or commands
         if os.path.exists('/usr/bin/cygpath') or os.path.exists('/cygdrive'):
@@ -528,22 +923,22 @@ def is_cygwin():
     return False
 
 
+@functools.lru_cache(maxsize=None)
 def find_cygwin_installation():
     """Find Cygwin installation directory.
     
     Returns the path to Cygwin root directory (e.g., C:\\cygwin64 or F:\\cygwin64),
     or None if not found.
+    
+    The result is cached, since the search may spawn 'where'/'which' and is
+    needed for every path conversion.
     """
-    # Common Cygwin installation locations
+    # Common Cygwin installation locations, only on drives that exist
+    # (one stat per drive instead of one per candidate path)
     common_paths = [
-        r'C:\cygwin64',
-        r'C:\cygwin',
-        r'D:\cygwin64',
-        r'D:\cygwin',
-        r'E:\cygwin64',
-        r'E:\cygwin',
-        r'F:\cygwin64',
-        r'F:\cygwin',
+        f'{drive}:\\{name}'
+        for drive in 'CDEF' if os.path.exists(f'{drive}:\\')
+        for name in ('cygwin64', 'cygwin')
     ]
     
     # Check if CYGWIN_ROOT environment variable is set
@@ -606,14 +1001,26 @@ def get_bash_path(config=None):
     Returns:
         Path to bash executable (Windows path if running Windows Python, Unix path if running Cygwin Python)
     """
+    return _find_bash_path(config.get('cygwin_root') if config else None)
+
+
+@functools.lru_cache(maxsize=None)
+def _find_bash_path(configured_cygwin_root=None):
+    """Find the bash executable for a configured Cygwin root (cached per root).
+    
+    Args:
+        configured_cygwin_root: cygwin_root from the config, or None
+    
+    Returns:
+        Path to bash executable, see get_bash_path
+    """
     cygwin_root = None
     # Detect Windows Python - check both os.name and sys.platform for reliability
     is_windows_python = (os.name == 'nt' or sys.platform.startswith('win'))
     
     # First, try to get from config
-    if config and config.get('cygwin_root'):
-        cygwin_root = config['cygwin_root']
-        cygwin_root = os.path.normpath(cygwin_root)
+    if configured_cygwin_root:
+        cygwin_root = os.path.normpath(configured_cygwin_root)
         bash_path = os.path.join(cygwin_root, 'bin', 'bash.exe')
         bash_path = os.path.normpath(bash_path)
         if os.path.exists(bash_path):
@@ -683,6 +1090,11 @@ def get_bash_path(config=None):
     return 'bash'
 
 
+def has_drive_letter(path):
+    """Check whether path starts with a Windows drive prefix such as "C:"."""
+    return len(path) >= 2 and path[1] == ':' and path[0] in DRIVE_LETTERS
+
+
 def convert_path_for_cygwin(path, config=None):
     """Convert Windows path to Cygwin path if running on Cygwin or using Cygwin bash.
     
@@ -698,24 +1110,13 @@ def convert_path_for_cygwin(path, config=None):
         if not os.path.exists(path):
             return path
         
+        # POSIX paths (e.g. temp files created by Cygwin Python) are already usable
+        if not has_drive_letter(path) and '\\' not in path:
+            return path
+        
         try:
-            # On Windows, prevent console window
-            startupinfo = None
-            if os.name == 'nt':
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-            
-            result = subprocess.run(
-                ['cygpath', '-u', path],
-                capture_output=True,
-                text=True,
-                timeout=5,
-                startupinfo=startupinfo
-            )
-            if result.returncode == 0:
-                return result.stdout.strip()
-        except (subprocess.TimeoutExpired, FileNotFoundError, OSError):
+            return _cygpath_to_unix(path)
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError, FileNotFoundError, OSError):
             pass
     
     # If using Cygwin bash from Windows Python, convert path manually
@@ -726,32 +1127,116 @@ def convert_path_for_cygwin(path, config=None):
         cygwin_root = find_cygwin_installation()
     
     if cygwin_root and os.name == 'nt':
-        # Convert Windows path to Cygwin path
-        # e.g., F:\cygwin64\home\user\file -> /home/user/file
-        # or F:\other\path\to\file -> /cygdrive/f/other/path/to/file
-        cygwin_root_norm = os.path.normpath(cygwin_root).replace('\\', '/')
-        path_norm = os.path.normpath(path).replace('\\', '/')
-        
-        # Check if path is within Cygwin root
-        if path_norm.lower().startswith(cygwin_root_norm.lower()):
-            # Path is within Cygwin, convert directly
-            cygwin_path = path_norm[len(cygwin_root_norm):].replace('\\', '/')
-            if cygwin_path.startswith('/'):
-                return cygwin_path
-            return '/' + cygwin_path
-        else:
-            # Path is outside Cygwin, use /cygdrive/X/... format
-            # Extract drive letter (e.g., F:)
-            drive_match = re.match(r'^([A-Za-z]):', path_norm)
-            if drive_match:
-                drive_letter = drive_match.group(1).lower()
-                # Remove drive letter and convert
-                rest_path = path_norm[2:].replace('\\', '/')
-                return f'/cygdrive/{drive_letter}{rest_path}'
+        return _convert_windows_path(path, cygwin_root)
+    
+    return path
+
+
+@functools.lru_cache(maxsize=CYGWIN_PATH_CACHE_SIZE)
+def _cygpath_to_unix(path):
+    """Convert a path with `cygpath -u` (cached, so each path spawns cygpath once).
+    
+    Failures raise instead of returning a value, so they are not cached.
+    
+    Args:
+        path: Windows path to convert
+    
+    Returns:
+        Cygwin path printed by cygpath
+    
+    Raises:
+        subprocess.CalledProcessError: If cygpath fails
+    """
+    # On Windows, prevent console window
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+    
+    result = subprocess.run(
+        ['cygpath', '-u', path],
+        capture_output=True,
+        text=True,
+        timeout=5,
+        startupinfo=startupinfo,
+        check=True
+    )
+    return result.stdout.strip()
+
+
+@functools.lru_cache(maxsize=None)
+def _normalize_cygwin_root(cygwin_root):
+    """Normalize a Cygwin root for prefix checks (cached, the root rarely changes).
+    
+    Args:
+        cygwin_root: Path to Cygwin installation
+    
+    Returns:
+        Tuple of (normalized root with forward slashes, its lowercase form)
+    """
+    cygwin_root_norm = os.path.normpath(cygwin_root).replace('\\', '/')
+    return cygwin_root_norm, cygwin_root_norm.lower()
+
+
+@functools.lru_cache(maxsize=CYGWIN_PATH_CACHE_SIZE)
+def _convert_windows_path(path, cygwin_root):
+    """Convert a Windows path to a Cygwin path without cygpath (cached per path and root).
+    
+    Args:
+        path: Windows path to convert
+        cygwin_root: Path to Cygwin installation
+    
+    Returns:
+        Cygwin-style path if conversion is possible, original path otherwise
+    """
+    # Convert Windows path to Cygwin path
+    # e.g., F:\cygwin64\home\user\file -> /home/user/file
+    # or F:\other\path\to\file -> /cygdrive/f/other/path/to/file
+    cygwin_root_norm, cygwin_root_lower = _normalize_cygwin_root(cygwin_root)
+    path_norm = os.path.normpath(path).replace('\\', '/')
+    
+    # Check if path is within Cygwin root
+    if path_norm.lower().startswith(cygwin_root_lower):
+        # Path is within Cygwin, convert directly
+        cygwin_path = path_norm[len(cygwin_root_norm):].replace('\\', '/')
+        if cygwin_path.startswith('/'):
+            return cygwin_path
+        return '/' + cygwin_path
+    else:
+        # Path is outside Cygwin, use /cygdrive/X/... format
+        # Extract drive letter (e.g., F:)
+        if has_drive_letter(path_norm):
+            drive_letter = path_norm[0].lower()
+            # Remove drive letter (backslashes are already converted)
+            return f'/cygdrive/{drive_letter}{path_norm[2:]}'
     
     return path
 
 
+def get_retry_wait_time(error, attempt, retry_delay):
+    """Get how long to wait before retrying a failed Telegram request.
+    
+    Args:
+        error: The exception raised by the request
+        attempt: Zero-based number of the failed attempt
+        retry_delay: Initial delay between retries in seconds
+    
+    Returns:
+        Seconds to wait: the flood-control wait requested by Telegram for RetryAfter,
+        otherwise exponential backoff. Both get a little random jitter so concurrent
+        requests (e.g. the downloads of a media group) do not retry in lockstep
+    """
+    if isinstance(error, RetryAfter):
+        retry_after = error.retry_after
+        # Newer python-telegram-bot versions report a timedelta
+        if hasattr(retry_after, 'total_seconds'):
+            retry_after = retry_after.total_seconds()
+        return retry_after + random.uniform(0, 0.25)
+    wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
+    return wait_time + random.uniform(0, wait_time * 0.2)
+
+
 async def download_media_file(bot, file, file_extension=None, max_retries=3, retry_delay=1.0):
     """Download a media file from Telegram and save it to a temporary file.
     
@@ -774,11 +1259,11 @@ async def download_media_file(bot, file, file_extension=None, max_retries=3, ret
                 try:
                     file_obj = await bot.get_file(file.file_id)
                     break
-                except (TimedOut, NetworkError) as e:
+                except (TimedOut, NetworkError, RetryAfter) as e:
                     last_exception = e
                     if attempt < max_retries - 1:
-                        wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                        logger.warning(f"get_file attempt {attempt + 1} failed with {type(e).__name__}, retrying in {wait_time}s...")
+                        wait_time = get_retry_wait_time(e, attempt, retry_delay)
+                        logger.warning(f"get_file attempt {attempt + 1} failed with {type(e).__name__}, retrying in {wait_time:.1f}s...")
                         await asyncio.sleep(wait_time)
                     else:
                         logger.error(f"Failed to get_file after {max_retries} attempts: {e}")
@@ -798,27 +1283,17 @@ async def download_media_file(bot, file, file_extension=None, max_retries=3, ret
         if not file_extension:
             if hasattr(file, 'mime_type') and file.mime_type:
                 # Extract extension from mime type
-                mime_to_ext = {
-                    'image/jpeg': 'jpg',
-                    'image/png': 'png',
-                    'image/gif': 'gif',
-                    'image/webp': 'webp',
-                    'video/mp4': 'mp4',
-                    'video/quicktime': 'mov',
-                    'video/x-msvideo': 'avi',
-                }
-                file_extension = mime_to_ext.get(file.mime_type, 'bin')
+                file_extension = MIME_TO_EXTENSION.get(file.mime_type, 'bin')
             else:
                 # Default based on file path if available
                 if hasattr(file_obj, 'file_path') and file_obj.file_path:
-                    file_extension = Path(file_obj.file_path).suffix.lstrip('.') or 'bin'
+                    file_extension = os.path.splitext(file_obj.file_path)[1].lstrip('.') or 'bin'
                 else:
                     file_extension = 'bin'
         
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}')
-        temp_path = temp_file.name
-        temp_file.close()
+        # Create temporary file (only its name is needed; download_to_drive reopens it)
+        temp_fd, temp_path = tempfile.mkstemp(suffix=f'.{file_extension}')
+        os.close(temp_fd)
         
         # Download the file with retry logic
         last_exception = None
@@ -827,11 +1302,11 @@ async def download_media_file(bot, file, file_extension=None, max_retries=3, ret
                 await file_obj.download_to_drive(temp_path)
                 logger.info(f"Downloaded media file to: {temp_path}")
                 return temp_path
-            except (TimedOut, NetworkError) as e:
+            except (TimedOut, NetworkError, RetryAfter) as e:
                 last_exception = e
                 if attempt < max_retries - 1:
-                    wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                    logger.warning(f"download_to_drive attempt {attempt + 1} failed with {type(e).__name__}, retrying in {wait_time}s...")
+                    wait_time = get_retry_wait_time(e, attempt, retry_delay)
+                    logger.warning(f"download_to_drive attempt {attempt + 1} failed with {type(e).__name__}, retrying in {wait_time:.1f}s...")
                     await asyncio.sleep(wait_time)
                     # Clean up partial download if it exists
                     try:
@@ -866,55 +1341,82 @@ async def download_media_file(bot, file, file_extension=None, max_retries=3, ret
         return None
 
 
-def build_command(profile_name, script_path, urls, extra_text, use_firefox=True, cookies_file=None, config=None, nsfw=False, disable_cookies_for_sites=None):
-    """Build the command to execute nostr_media_uploader.sh.
+@functools.lru_cache(maxsize=None)
+def resolve_command_paths(script_path, cygwin_root=None):
+    """Resolve the bash and script paths used by build_command.
+    
+    These only depend on configuration, so they are resolved (and converted to
+    Cygwin paths if needed) once per distinct configuration instead of on every
+    message. A /reload with different paths simply produces a new cache entry.
+    The cookies file is not resolved here: it may not exist yet, and its Cygwin
+    conversion changes once it does.
     
     Args:
-        profile_name: Profile name to use
-        script_path: Path to nostr_media_uploader.sh
-        urls: List of URLs or file paths
-        extra_text: Additional text/description
-        use_firefox: Whether to use Firefox cookies (default: True)
-        cookies_file: Path to cookies file (takes precedence over use_firefox)
-        config: Config dict (for path conversion)
-        nsfw: Whether to add --nsfw flag (default: False)
-        disable_cookies_for_sites: List of domain patterns to disable cookies for (default: None)
+        script_path: Path to nostr_media_uploader.sh (relative to this file if not absolute)
+        cygwin_root: Optional path to Cygwin installation
+    
+    Returns:
+        Tuple of (bash_path, script_path)
     """
+    path_config = {'cygwin_root': cygwin_root}
+    
     # Convert script path to absolute path
     script_path = Path(script_path)
     if not script_path.is_absolute():
         script_dir = Path(__file__).parent.absolute()
         script_path = script_dir / script_path
     
-    script_path = str(script_path)
-    
-    # Convert to Cygwin path if needed (using config if available)
-    script_path = convert_path_for_cygwin(script_path, config)
+    # Convert to Cygwin path if needed
+    script_path = convert_path_for_cygwin(str(script_path), path_config)
     
     # Get the correct bash path for the environment
-    bash_path = get_bash_path(config)
+    bash_path = get_bash_path(path_config)
     
     # Validate bash path exists
     if not os.path.exists(bash_path) and os.path.isabs(bash_path):
         raise FileNotFoundError(f"Bash executable not found: {bash_path}")
     
-    logger.info(f"Using bash: {bash_path}")
-    logger.info(f"Script path: {script_path}")
+    return bash_path, script_path
+
+
+def build_command(profile_name, script_path, urls, extra_text, use_firefox=True, cookies_file=None, config=None, nsfw=False, disable_cookies_for_sites=None):
+    """Build the command to execute nostr_media_uploader.sh.
+    
+    Args:
+        profile_name: Profile name to use
+        script_path: Path to nostr_media_uploader.sh
+        urls: List of URLs or file paths
+        extra_text: Additional text/description
+        use_firefox: Whether to use Firefox cookies (default: True)
+        cookies_file: Path to cookies file (takes precedence over use_firefox)
+        config: Config dict (for path conversion)
+        nsfw: Whether to add --nsfw flag (default: False)
+        disable_cookies_for_sites: List of domain patterns to disable cookies for (default: None)
+    """
+    bash_path, script_path = resolve_command_paths(
+        script_path,
+        config.get('cygwin_root') if config else None
+    )
+    
+    # Convert cookies file path to Cygwin path if needed (on every call, since the
+    # conversion depends on whether the file exists yet)
+    cookies_path = convert_path_for_cygwin(cookies_file, config) if cookies_file else None
+    
+    logger.info("Using bash: %s", bash_path)
+    logger.info("Script path: %s", script_path)
     
     # Check if cookies should be disabled for any URLs
     disable_cookies = should_disable_cookies(urls, disable_cookies_for_sites)
     if disable_cookies_for_sites:
-        logger.debug(f"Checking disable_cookies_for_sites: {disable_cookies_for_sites} against URLs: {urls}, result: {disable_cookies}")
+        logger.debug("Checking disable_cookies_for_sites: %s against URLs: %s, result: %s", disable_cookies_for_sites, urls, disable_cookies)
     
     # Build command: bash script_path -p profile_name [--cookies FILE|--firefox] [--nsfw] url1 url2 ... "extra_text"
     cmd = [bash_path, script_path, '-p', profile_name]
     
     # Use cookies file if provided and not disabled (takes precedence over --firefox)
-    if cookies_file and not disable_cookies:
-        # Convert cookies file path to Cygwin path if needed
-        cookies_path = convert_path_for_cygwin(cookies_file, config)
+    if cookies_path and not disable_cookies:
         cmd.extend(['--cookies', cookies_path])
-        logger.info(f"Adding --cookies parameter with file: {cookies_path}")
+        logger.info("Adding --cookies parameter with file: %s", cookies_path)
     elif use_firefox and not disable_cookies:
         # Only add --firefox if cookies_file is not set and cookies are not disabled
         cmd.append('--firefox')
@@ -948,45 +1450,268 @@ def build_command(profile_name, script_path, urls, extra_text, use_firefox=True,
     return cmd
 
 
-async def get_cygwin_pid(windows_pid):
-    """Map a Windows PID to a Cygwin PID using ps command.
+async def get_cygwin_pid_map():
+    """Map all Windows PIDs to Cygwin PIDs with a single ps command.
     
-    Args:
-        windows_pid: Windows process ID
+    The listing is cached for CYGWIN_PID_MAP_TTL seconds, so looking up every
+    process of a tree runs ps once instead of once per process.
     
     Returns:
-        Cygwin PID if found, None otherwise
+        Dict mapping Windows PIDs to Cygwin PIDs (empty if ps failed)
     """
-    if not IS_CYGWIN:
-        return windows_pid  # Not Cygwin, return as-is
+    global cygwin_pid_map_cache
     
+    if cygwin_pid_map_cache is not None and time.monotonic() - cygwin_pid_map_cache[0] < CYGWIN_PID_MAP_TTL:
+        return cygwin_pid_map_cache[1]
+    
+    pid_map = {}
     try:
-        # Use ps to find the Cygwin PID for this Windows PID
-        # Format: ps -W -p <windows_pid> -o pid=,ppid=,winpid=
-        # We want the pid column (Cygwin PID) where winpid matches
+        # Format: ps -W -o pid=,winpid= lists every process as "<cygwin_pid> <winpid>"
         proc = await asyncio.create_subprocess_exec(
-            'ps', '-W', '-p', str(windows_pid), '-o', 'pid=,winpid=',
+            'ps', '-W', '-o', 'pid=,winpid=',
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.DEVNULL
         )
         stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=2.0)
         
         if proc.returncode == 0 and stdout:
-            # Parse output: lines are like "12345 67890" (cygwin_pid winpid)
-            for line in stdout.decode('utf-8', errors='ignore').strip().split('\n'):
-                parts = line.strip().split()
+            # The output is ASCII digits, so it is parsed as bytes (int() accepts them)
+            for line in stdout.splitlines():
+                parts = line.split()
                 if len(parts) >= 2:
-                    cygwin_pid = parts[0].strip()
-                    winpid = parts[1].strip()
-                    if winpid == str(windows_pid):
-                        logger.debug(f"Mapped Windows PID {windows_pid} to Cygwin PID {cygwin_pid}")
-                        return int(cygwin_pid)
-        
-        logger.debug(f"Could not map Windows PID {windows_pid} to Cygwin PID (process may not exist in Cygwin)")
-        return None
-    except (asyncio.TimeoutError, FileNotFoundError, ValueError, Exception) as e:
-        logger.debug(f"Error mapping Windows PID {windows_pid} to Cygwin PID: {e}")
-        return None
+                    try:
+                        pid_map[int(parts[1])] = int(parts[0])
+                    except ValueError:
+                        continue
+    except (asyncio.TimeoutError, FileNotFoundError, Exception) as e:
+        logger.debug("Error listing Cygwin PIDs: %s", e)
+    
+    cygwin_pid_map_cache = (time.monotonic(), pid_map)
+    return pid_map
+
+
+async def get_cygwin_pid(windows_pid, pid_map=None):
+    """Map a Windows PID to a Cygwin PID using ps command.
+    
+    Args:
+        windows_pid: Windows process ID
+        pid_map: Optional result of get_cygwin_pid_map() to look the PID up in,
+            so callers mapping several processes can share one listing
+    
+    Returns:
+        Cygwin PID if found, None otherwise
+    """
+    if not IS_CYGWIN:
+        return windows_pid  # Not Cygwin, return as-is
+    
+    if pid_map is None:
+        pid_map = await get_cygwin_pid_map()
+    
+    cygwin_pid = pid_map.get(windows_pid)
+    if cygwin_pid:
+        logger.debug("Mapped Windows PID %s to Cygwin PID %s", windows_pid, cygwin_pid)
+    else:
+        logger.debug("Could not map Windows PID %s to Cygwin PID (process may not exist in Cygwin)", windows_pid)
+    return cygwin_pid
+
+
+async def send_cygwin_signal(cygwin_pids, sig, timeout=1.0):
+    """Send a signal to one or more processes by their Cygwin PIDs.
+    
+    Under Cygwin Python os.kill() accepts Cygwin PIDs, so the signal is sent
+    without spawning anything. The kill command is only run on native Windows
+    Python (where os.kill() cannot signal Cygwin processes) or for the PIDs
+    os.kill() failed on, and then once for all of them.
+    
+    Args:
+        cygwin_pids: Cygwin process ID, or a list of Cygwin process IDs
+        sig: Signal to send (e.g. signal.SIGINT, signal.SIGKILL)
+        timeout: Time to wait for the kill command (seconds)
+    
+    Raises:
+        asyncio.TimeoutError: If the kill command did not finish in time
+        FileNotFoundError: If the kill command is not available
+    """
+    if isinstance(cygwin_pids, int):
+        cygwin_pids = [cygwin_pids]
+    
+    if IS_CYGWIN:
+        failed_pids = []
+        for cygwin_pid in cygwin_pids:
+            try:
+                os.kill(cygwin_pid, sig)
+            except ProcessLookupError:
+                pass  # Already gone, same outcome as a failed kill command
+            except OSError as e:
+                logger.debug("os.kill(%s, %s) failed: %s, falling back to kill command", cygwin_pid, sig.name, e)
+                failed_pids.append(cygwin_pid)
+        cygwin_pids = failed_pids
+    
+    if not cygwin_pids:
+        return
+    
+    kill_proc = await asyncio.create_subprocess_exec(
+        'kill', f'-{sig.name[3:]}', *map(str, cygwin_pids),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    await asyncio.wait_for(kill_proc.wait(), timeout=timeout)
+
+
+def describe_process(proc):
+    """Get the name and command line of a process for logging.
+    
+    Both are read in a single psutil oneshot() pass (via as_dict) instead of
+    separate name() and cmdline() calls.
+    
+    Args:
+        proc: psutil.Process to describe
+    
+    Returns:
+        Tuple of (name, command), '<access denied>' / 'N/A' where not readable
+    
+    Raises:
+        psutil.NoSuchProcess: If the process no longer exists
+    """
+    info = proc.as_dict(attrs=['name', 'cmdline'])
+    name = info['name'] if info['name'] is not None else '<access denied>'
+    command = ' '.join(info['cmdline']) if info['cmdline'] is not None else 'N/A'
+    return name, command
+
+
+def own_process_group(pid):
+    """Check whether a process leads a process group other than ours.
+    
+    Such a group can be signalled as a whole with os.killpg() without also
+    signalling the bot itself.
+    
+    Args:
+        pid: Process ID
+    
+    Returns:
+        True if the process is the leader of a separate process group
+    """
+    try:
+        return os.getpgid(pid) == pid and pid != os.getpgrp()
+    except (ProcessLookupError, OSError, AttributeError):
+        return False
+
+
+def signal_process_group(pid, sig):
+    """Send a signal to a process and, if it leads its own group, to the whole group.
+    
+    Never signals the bot's own process group, which scripts share on Cygwin.
+    
+    Args:
+        pid: Process ID
+        sig: Signal to send
+    
+    Raises:
+        ProcessLookupError: If the process does not exist
+    """
+    if own_process_group(pid):
+        os.killpg(pid, sig)
+    else:
+        os.kill(pid, sig)
+
+
+async def signal_tree_process(proc, pid_map, label, force=False, timeout=1.0):
+    """Send SIGINT (or SIGKILL if force is set) to one process of a tree being killed.
+    
+    Subprocesses launched via bash.exe are always Cygwin processes, so on Cygwin
+    (and on native Windows for SIGINT) they are signalled by Cygwin PID, with
+    psutil as the fallback if the PID cannot be mapped or signalled. Everywhere
+    else psutil signals the process directly.
+    
+    Args:
+        proc: psutil.Process to signal
+        pid_map: Result of get_cygwin_pid_map(), or None when not on Cygwin
+        label: Log prefix naming the kill step, e.g. "[FORCE KILL]"
+        force: Send SIGKILL instead of SIGINT
+        timeout: Time to wait for the Cygwin kill command (seconds)
+    
+    Raises:
+        psutil.NoSuchProcess: If the process no longer exists
+        psutil.AccessDenied: If the process cannot be signalled
+    """
+    signal_name = "SIGKILL" if force else "SIGINT"
+    
+    if IS_CYGWIN or (os.name == 'nt' and not force):
+        # Cygwin: map Windows PID to Cygwin PID, then signal it
+        cygwin_pid = await get_cygwin_pid(proc.pid, pid_map)
+        if cygwin_pid:
+            try:
+                logger.warning("%s Platform: Cygwin | Method: Cygwin %s (os.kill/kill) | Windows PID: %s -> Cygwin PID: %s", label, signal_name, proc.pid, cygwin_pid)
+                await send_cygwin_signal(cygwin_pid, signal.SIGKILL if force else signal.SIGINT, timeout=timeout)
+                return
+            except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as kill_err:
+                reason = f"kill command failed: {kill_err}"
+        else:
+            reason = "PID mapping failed"
+        logger.warning("%s Platform: Cygwin | Method: psutil %s (fallback - %s) | Windows PID: %s", label, signal_name, reason, proc.pid)
+    else:
+        logger.warning("%s Platform: %s | Method: psutil %s | PID: %s", label, "Windows" if os.name == 'nt' else "Linux", signal_name, proc.pid)
+    
+    if force:
+        proc.kill()
+    else:
+        proc.send_signal(signal.SIGINT)
+
+
+async def wait_procs_async(procs, timeout):
+    """Wait for processes to exit without blocking the event loop.
+    
+    psutil.wait_procs() blocks until the processes exit or the timeout expires,
+    so it runs in the default thread pool executor.
+    
+    Args:
+        procs: List of psutil.Process objects
+        timeout: Maximum time to wait (seconds)
+    
+    Returns:
+        Tuple of (gone, alive) lists, as returned by psutil.wait_procs()
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(psutil.wait_procs, procs, timeout=timeout))
+
+
+async def wait_tree_async(parent, procs, timeout):
+    """Wait for processes of a tree to exit without reaping our own subprocess.
+    
+    psutil.wait_procs() reaps processes that are children of this one, which
+    would steal a script's exit status from asyncio. When parent is a tracked
+    script, it is waited for through its asyncio process instead, alongside
+    wait_procs_async() for the rest of the tree.
+    
+    Args:
+        parent: psutil.Process at the root of the tree
+        procs: List of psutil.Process objects to wait for (may include parent)
+        timeout: Maximum time to wait (seconds)
+    
+    Returns:
+        Tuple of (gone, alive) lists, as returned by psutil.wait_procs()
+    """
+    tracked = running_processes.get(parent.pid)
+    others = [proc for proc in procs if proc.pid != parent.pid]
+    if tracked is None or len(others) == len(procs):
+        return await wait_procs_async(procs, timeout)
+    
+    async def wait_parent():
+        try:
+            await asyncio.wait_for(tracked['process'].wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        return tracked['process'].returncode is not None
+    
+    if others:
+        parent_gone, (gone, alive) = await asyncio.gather(wait_parent(), wait_procs_async(others, timeout))
+    else:
+        parent_gone, gone, alive = await wait_parent(), [], []
+    if parent_gone:
+        gone = [parent] + list(gone)
+    else:
+        alive = [parent] + list(alive)
+    return gone, alive
 
 
 async def kill_process_tree(pid, timeout=5.0):
@@ -1036,10 +1761,10 @@ async def kill_process_tree(pid, timeout=5.0):
                         try:
                             os.kill(pid, 0)  # Check if process exists
                             # Still running, send SIGTERM to process group (including children)
-                            os.killpg(os.getpgid(pid), signal.SIGTERM)
+                            signal_process_group(pid, signal.SIGTERM)
                             await asyncio.sleep(1)
                             # Force kill if still running
-                            os.killpg(os.getpgid(pid), signal.SIGKILL)
+                            signal_process_group(pid, signal.SIGKILL)
                         except ProcessLookupError:
                             pass  # Process already dead
                     except ProcessLookupError:
@@ -1061,42 +1786,44 @@ async def kill_process_tree(pid, timeout=5.0):
         # Get all child processes recursively BEFORE sending signal
         # We'll check if they're still running after parent exits
         children = parent.children(recursive=True)
-        child_pids = [p.pid for p in children]
         
-        # Log detailed process tree information
-        logger.warning(f"[PROCESS TREE] ========== Starting kill operation ==========")
-        logger.warning(f"[PROCESS TREE] Parent process:")
-        try:
-            parent_cmd = ' '.join(parent.cmdline()) if hasattr(parent, 'cmdline') else 'N/A'
-            logger.warning(f"[PROCESS TREE]   PID: {pid} (Windows PID)")
-            logger.warning(f"[PROCESS TREE]   Name: {parent.name()}")
-            logger.warning(f"[PROCESS TREE]   Command: {parent_cmd}")
-            if IS_CYGWIN:
-                cygwin_pid = await get_cygwin_pid(pid)
-                if cygwin_pid:
-                    logger.warning(f"[PROCESS TREE]   Cygwin PID: {cygwin_pid}")
-                else:
-                    logger.warning(f"[PROCESS TREE]   Cygwin PID: <could not map>")
-        except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-            logger.warning(f"[PROCESS TREE]   Error getting parent info: {e}")
+        # One ps listing maps the PIDs of the whole tree
+        pid_map = await get_cygwin_pid_map() if IS_CYGWIN else None
         
-        logger.warning(f"[PROCESS TREE] Child processes: {len(children)}")
-        if children:
+        # Log detailed process tree information (skipped entirely if warnings are not logged)
+        if logger.isEnabledFor(logging.WARNING):
+            logger.warning("[PROCESS TREE] ========== Starting kill operation ==========")
+            logger.warning("[PROCESS TREE] Parent process:")
+            try:
+                parent_name, parent_cmd = describe_process(parent)
+                logger.warning("[PROCESS TREE]   PID: %s (Windows PID)", pid)
+                logger.warning("[PROCESS TREE]   Name: %s", parent_name)
+                logger.warning("[PROCESS TREE]   Command: %s", parent_cmd)
+                if IS_CYGWIN:
+                    cygwin_pid = await get_cygwin_pid(pid, pid_map)
+                    if cygwin_pid:
+                        logger.warning("[PROCESS TREE]   Cygwin PID: %s", cygwin_pid)
+                    else:
+                        logger.warning("[PROCESS TREE]   Cygwin PID: <could not map>")
+            except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+                logger.warning("[PROCESS TREE]   Error getting parent info: %s", e)
+            
+            logger.warning("[PROCESS TREE] Child processes: %s", len(children))
             for i, child in enumerate(children, 1):
                 try:
-                    child_cmd = ' '.join(child.cmdline()) if hasattr(child, 'cmdline') else 'N/A'
-                    logger.warning(f"[PROCESS TREE]   Child {i}:")
-                    logger.warning(f"[PROCESS TREE]     Windows PID: {child.pid}")
-                    logger.warning(f"[PROCESS TREE]     Name: {child.name()}")
-                    logger.warning(f"[PROCESS TREE]     Command: {child_cmd}")
+                    child_name, child_cmd = describe_process(child)
+                    logger.warning("[PROCESS TREE]   Child %s:", i)
+                    logger.warning("[PROCESS TREE]     Windows PID: %s", child.pid)
+                    logger.warning("[PROCESS TREE]     Name: %s", child_name)
+                    logger.warning("[PROCESS TREE]     Command: %s", child_cmd)
                     if IS_CYGWIN:
-                        child_cygwin_pid = await get_cygwin_pid(child.pid)
+                        child_cygwin_pid = await get_cygwin_pid(child.pid, pid_map)
                         if child_cygwin_pid:
-                            logger.warning(f"[PROCESS TREE]     Cygwin PID: {child_cygwin_pid}")
+                            logger.warning("[PROCESS TREE]     Cygwin PID: %s", child_cygwin_pid)
                         else:
-                            logger.warning(f"[PROCESS TREE]     Cygwin PID: <could not map>")
+                            logger.warning("[PROCESS TREE]     Cygwin PID: <could not map>")
                 except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                    logger.warning(f"[PROCESS TREE]   Child {i}: PID {child.pid} (Windows) | Error: {e}")
+                    logger.warning("[PROCESS TREE]   Child %s: PID %s (Windows) | Error: %s", i, child.pid, e)
         
         logger.info(f"Killing process tree: parent PID {pid} and {len(children)} child process(es)")
         
@@ -1104,35 +1831,16 @@ async def kill_process_tree(pid, timeout=5.0):
         # SIGINT matches Control-C behavior exactly, triggering the same trap handlers
         # This gives bash scripts time to execute their trap handlers (e.g., cleanup function)
         try:
-            # On Windows, subprocesses launched via bash.exe are ALWAYS Cygwin processes
-            # So we should use Cygwin kill methods, not Windows methods
-            if os.name == 'nt' or IS_CYGWIN:
-                # Cygwin: map Windows PID to Cygwin PID, then use kill command
-                cygwin_pid = await get_cygwin_pid(pid)
-                if cygwin_pid:
-                    try:
-                        logger.warning(f"[KILL_PROCESS_TREE] Platform: Cygwin (Windows subprocess) | Method: 'kill -INT' command | Windows PID: {pid} -> Cygwin PID: {cygwin_pid}")
-                        kill_proc = await asyncio.create_subprocess_exec(
-                            'kill', '-INT', str(cygwin_pid),
-                            stdout=asyncio.subprocess.DEVNULL,
-                            stderr=asyncio.subprocess.DEVNULL
-                        )
-                        await asyncio.wait_for(kill_proc.wait(), timeout=2.0)
-                        logger.debug(f"Sent SIGINT to parent process (Windows PID {pid}, Cygwin PID {cygwin_pid}) via Cygwin kill command (matching Control-C), waiting for cleanup handlers...")
-                    except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as kill_err:
-                        # Fallback to psutil send_signal if kill command fails
-                        logger.warning(f"[KILL_PROCESS_TREE] Platform: Cygwin (Windows subprocess) | Method: psutil.send_signal() (fallback - kill command failed: {kill_err}) | Windows PID: {pid}")
-                        parent.send_signal(signal.SIGINT)
-                        logger.debug(f"Sent SIGINT to parent process {pid} via psutil (fallback), waiting for cleanup handlers...")
-                else:
-                    # Could not map PID, fallback to psutil
-                    logger.warning(f"[KILL_PROCESS_TREE] Platform: Cygwin (Windows subprocess) | Method: psutil.send_signal() (fallback - PID mapping failed) | Windows PID: {pid}")
-                    parent.send_signal(signal.SIGINT)
-                    logger.debug(f"Sent SIGINT to parent process {pid} via psutil (fallback), waiting for cleanup handlers...")
+            if own_process_group(pid):
+                # Linux: the script leads its own process group (see execute_script),
+                # so one killpg() delivers SIGINT to the whole tree, like Control-C
+                logger.warning(f"[KILL_PROCESS_TREE] Platform: Linux | Method: os.killpg() (SIGINT to process group) | PID: {pid}")
+                try:
+                    os.killpg(pid, signal.SIGINT)
+                except ProcessLookupError:
+                    pass  # Already gone
             else:
-                # Linux: use psutil send_signal
-                logger.warning(f"[KILL_PROCESS_TREE] Platform: Linux | Method: psutil.send_signal() (SIGINT) | PID: {pid}")
-                parent.send_signal(signal.SIGINT)
+                await signal_tree_process(parent, pid_map, "[KILL_PROCESS_TREE]", timeout=2.0)
         except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
             logger.debug(f"Could not signal parent process {pid}: {e}")
         
@@ -1140,15 +1848,21 @@ async def kill_process_tree(pid, timeout=5.0):
         # Give it more time if there are many children (they need to be cleaned up)
         wait_time = min(timeout, max(2.0, len(children) * 0.5))
         try:
-            # Use polling with asyncio.sleep to allow KeyboardInterrupt to be handled
             start_time = time.time()
-            while parent.is_running() and (time.time() - start_time) < wait_time:
-                try:
-                    await asyncio.sleep(0.1)
-                except (KeyboardInterrupt, asyncio.CancelledError):
-                    # If interrupted, break and proceed to force kill
-                    logger.warning("Process wait interrupted, proceeding to force kill...")
-                    break
+            try:
+                if pid in running_processes:
+                    # Our own subprocess: the event loop is notified as soon as it exits.
+                    # Like every wait in this function it goes through wait_tree_async(),
+                    # since psutil.wait_procs() would reap it and steal its exit status
+                    await wait_tree_async(parent, [parent], wait_time)
+                else:
+                    # Not our child, so it cannot be waited for (waitpid/waitid only
+                    # work for children): poll with asyncio.sleep instead
+                    while parent.is_running() and (time.time() - start_time) < wait_time:
+                        await asyncio.sleep(0.25)
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                # If interrupted, proceed to force kill
+                logger.warning("Process wait interrupted, proceeding to force kill...")
             
             if not parent.is_running():
                 signal_name = "SIGINT" if os.name != 'nt' else "SIGTERM"
@@ -1158,18 +1872,15 @@ async def kill_process_tree(pid, timeout=5.0):
                 # Bash scripts with cleanup handlers need time to actually execute the cleanup
                 # Some children might be in the middle of cleanup operations
                 logger.debug("Waiting for parent's cleanup handlers to finish cleaning up children...")
-                await asyncio.sleep(3.0)  # Increased wait time for cleanup to complete
                 
                 # Check if any of the known child processes are still running
                 # The parent's cleanup handler should have killed them, but verify
-                still_running_children = []
-                for child_pid in child_pids:
-                    try:
-                        child_proc = psutil.Process(child_pid)
-                        if child_proc.is_running():
-                            still_running_children.append(child_proc)
-                    except (psutil.NoSuchProcess, psutil.AccessDenied):
-                        pass  # Child already dead, which is what we want
+                # (is_running() on the snapshot objects needs no new process lookup
+                # and also detects PIDs reused by unrelated processes).
+                # Waits up to 3s for cleanup, but returns as soon as all children are gone
+                still_running_children = [child for child in children if child.is_running()]
+                if still_running_children:
+                    gone, still_running_children = await wait_procs_async(still_running_children, 3.0)
                 
                 if still_running_children:
                     logger.info(f"Parent exited but {len(still_running_children)} child process(es) still running, waiting for cleanup to finish...")
@@ -1177,38 +1888,17 @@ async def kill_process_tree(pid, timeout=5.0):
                     # Children might be cleaning up temp files, etc.
                     try:
                         logger.debug("Waiting up to 5s for children to finish cleanup...")
-                        gone, still_alive = psutil.wait_procs(still_running_children, timeout=5.0)
+                        gone, still_alive = await wait_procs_async(still_running_children, 5.0)
                         if still_alive:
                             logger.warning(f"Force killing {len(still_alive)} remaining child process(es) after cleanup timeout...")
                             # Give them one last chance (they might be almost done)
                             await asyncio.sleep(1.0)
                             # Re-check - they might have finished
                             still_alive = [p for p in still_alive if p.is_running()]
+                            pid_map = await get_cygwin_pid_map() if IS_CYGWIN else None
                             for proc in still_alive:
                                 try:
-                                    if IS_CYGWIN:
-                                        # Cygwin: map Windows PID to Cygwin PID, then use kill -KILL command
-                                        cygwin_pid = await get_cygwin_pid(proc.pid)
-                                        if cygwin_pid:
-                                            try:
-                                                logger.warning(f"[FORCE KILL CHILD] Platform: Cygwin | Method: 'kill -KILL' command | Windows PID: {proc.pid} -> Cygwin PID: {cygwin_pid}")
-                                                kill_proc = await asyncio.create_subprocess_exec(
-                                                    'kill', '-KILL', str(cygwin_pid),
-                                                    stdout=asyncio.subprocess.DEVNULL,
-                                                    stderr=asyncio.subprocess.DEVNULL
-                                                )
-                                                await asyncio.wait_for(kill_proc.wait(), timeout=1.0)
-                                                logger.debug(f"Force killed child process (Windows PID {proc.pid}, Cygwin PID {cygwin_pid}) via Cygwin kill -KILL command")
-                                            except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as kill_err:
-                                                # Fallback to psutil kill
-                                                logger.warning(f"[FORCE KILL CHILD] Platform: Cygwin | Method: psutil.kill() (fallback - kill command failed: {kill_err}) | Windows PID: {proc.pid}")
-                                                proc.kill()
-                                        else:
-                                            # Could not map PID, fallback to psutil
-                                            logger.warning(f"[FORCE KILL CHILD] Platform: Cygwin | Method: psutil.kill() (fallback - PID mapping failed) | Windows PID: {proc.pid}")
-                                            proc.kill()
-                                    else:
-                                        proc.kill()
+                                    await signal_tree_process(proc, pid_map, "[FORCE KILL CHILD]", force=True)
                                 except (psutil.NoSuchProcess, psutil.AccessDenied):
                                     pass
                     except Exception as e:
@@ -1228,63 +1918,45 @@ async def kill_process_tree(pid, timeout=5.0):
         # Step 2: If parent didn't exit, get fresh list of children and kill everything
         try:
             if parent.is_running():
-                # Get fresh list of children (in case they changed)
+                # Get fresh list of children: the parent is still running and may
+                # have started new ones since the first snapshot
                 children = parent.children(recursive=True)
                 all_procs = [parent] + children
+                pid_map = await get_cygwin_pid_map() if IS_CYGWIN else None
                 
-                logger.warning(f"[PROCESS TREE] Parent still running, force terminating {len(all_procs)} process(es) in tree:")
-                logger.warning(f"[PROCESS TREE]   Parent: PID {parent.pid} (Windows) | Name: {parent.name()}")
-                if children:
-                    logger.warning(f"[PROCESS TREE]   Children ({len(children)}):")
-                    for i, child in enumerate(children, 1):
+                # Describe each process once; the descriptions are logged twice below
+                log_tree = logger.isEnabledFor(logging.WARNING)
+                descriptions = {}
+                if log_tree:
+                    for proc in all_procs:
                         try:
-                            child_cmd = ' '.join(child.cmdline()) if hasattr(child, 'cmdline') else 'N/A'
-                            logger.warning(f"[PROCESS TREE]     Child {i}: PID {child.pid} (Windows) | Name: {child.name()} | Command: {child_cmd}")
+                            descriptions[proc.pid] = describe_process(proc)
                         except (psutil.NoSuchProcess, psutil.AccessDenied):
-                            logger.warning(f"[PROCESS TREE]     Child {i}: PID {child.pid} (Windows) | Name: <access denied>")
+                            descriptions[proc.pid] = ("<access denied>", "N/A")
+                    
+                    logger.warning("[PROCESS TREE] Parent still running, force terminating %s process(es) in tree:", len(all_procs))
+                    logger.warning("[PROCESS TREE]   Parent: PID %s (Windows) | Name: %s", parent.pid, descriptions[parent.pid][0])
+                    if children:
+                        logger.warning("[PROCESS TREE]   Children (%s):", len(children))
+                        for i, child in enumerate(children, 1):
+                            child_name, child_cmd = descriptions[child.pid]
+                            logger.warning("[PROCESS TREE]     Child %s: PID %s (Windows) | Name: %s | Command: %s", i, child.pid, child_name, child_cmd)
                 
                 logger.info(f"Force terminating {len(all_procs)} process(es) in tree...")
                 # Terminate all remaining processes (use SIGINT on Unix to match Control-C)
                 for proc in all_procs:
+                    if log_tree:
+                        proc_name, proc_cmd = descriptions[proc.pid]
+                        logger.warning("[PROCESS TREE]   Sending SIGINT to: PID %s (Windows) | Name: %s | Command: %s", proc.pid, proc_name, proc_cmd)
                     try:
-                        proc_name = proc.name()
-                        proc_cmd = ' '.join(proc.cmdline()) if hasattr(proc, 'cmdline') else 'N/A'
-                        logger.warning(f"[PROCESS TREE]   Sending SIGINT to: PID {proc.pid} (Windows) | Name: {proc_name} | Command: {proc_cmd}")
-                    except (psutil.NoSuchProcess, psutil.AccessDenied):
-                        proc_name = "<access denied>"
-                        proc_cmd = "N/A"
-                    try:
-                        # On Windows, subprocesses launched via bash.exe are ALWAYS Cygwin processes
-                        if os.name == 'nt' or IS_CYGWIN:
-                            # Cygwin: map Windows PID to Cygwin PID, then use kill command
-                            cygwin_pid = await get_cygwin_pid(proc.pid)
-                            if cygwin_pid:
-                                try:
-                                    logger.warning(f"[FORCE TERMINATE] Platform: Cygwin | Method: 'kill -INT' command | Windows PID: {proc.pid} -> Cygwin PID: {cygwin_pid}")
-                                    kill_proc = await asyncio.create_subprocess_exec(
-                                        'kill', '-INT', str(cygwin_pid),
-                                        stdout=asyncio.subprocess.DEVNULL,
-                                        stderr=asyncio.subprocess.DEVNULL
-                                    )
-                                    await asyncio.wait_for(kill_proc.wait(), timeout=1.0)
-                                    logger.debug(f"Sent SIGINT to process (Windows PID {proc.pid}, Cygwin PID {cygwin_pid}) via Cygwin kill command")
-                                except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as kill_err:
-                                    # Fallback to psutil if kill command fails
-                                    logger.warning(f"[FORCE TERMINATE] Platform: Cygwin | Method: psutil.send_signal() (fallback - kill command failed: {kill_err}) | Windows PID: {proc.pid}")
-                                    proc.send_signal(signal.SIGINT)
-                            else:
-                                # Could not map PID, fallback to psutil
-                                logger.warning(f"[FORCE TERMINATE] Platform: Cygwin | Method: psutil.send_signal() (fallback - PID mapping failed) | Windows PID: {proc.pid}")
-                                proc.send_signal(signal.SIGINT)
-                        else:
-                            proc.send_signal(signal.SIGINT)
+                        await signal_tree_process(proc, pid_map, "[FORCE TERMINATE]")
                     except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
                         logger.debug(f"Could not signal process {proc.pid}: {e}")
                 
                 # Wait for graceful termination
                 remaining_timeout = max(2.0, timeout - wait_time)
                 try:
-                    gone, still_alive = psutil.wait_procs(all_procs, timeout=remaining_timeout)
+                    gone, still_alive = await wait_tree_async(parent, all_procs, remaining_timeout)
                     if still_alive:
                         logger.warning(f"Force killing {len(still_alive)} process(es) that didn't terminate...")
                 except Exception as e:
@@ -1294,35 +1966,13 @@ async def kill_process_tree(pid, timeout=5.0):
                 # Step 3: Force kill any processes that didn't terminate
                 for proc in still_alive:
                     try:
-                        if IS_CYGWIN:
-                            # Cygwin: map Windows PID to Cygwin PID, then use kill -KILL command
-                            cygwin_pid = await get_cygwin_pid(proc.pid)
-                            if cygwin_pid:
-                                try:
-                                    logger.warning(f"[FORCE KILL] Platform: Cygwin | Method: 'kill -KILL' command | Windows PID: {proc.pid} -> Cygwin PID: {cygwin_pid}")
-                                    kill_proc = await asyncio.create_subprocess_exec(
-                                        'kill', '-KILL', str(cygwin_pid),
-                                        stdout=asyncio.subprocess.DEVNULL,
-                                        stderr=asyncio.subprocess.DEVNULL
-                                    )
-                                    await asyncio.wait_for(kill_proc.wait(), timeout=1.0)
-                                except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as kill_err:
-                                    # Fallback to psutil kill
-                                    logger.warning(f"[FORCE KILL] Platform: Cygwin | Method: psutil.kill() (fallback - kill command failed: {kill_err}) | Windows PID: {proc.pid}")
-                                    proc.kill()
-                            else:
-                                # Could not map PID, fallback to psutil
-                                logger.warning(f"[FORCE KILL] Platform: Cygwin | Method: psutil.kill() (fallback - PID mapping failed) | Windows PID: {proc.pid}")
-                                proc.kill()
-                        else:
-                            logger.warning(f"[FORCE KILL] Platform: Linux | Method: proc.kill() (SIGKILL) | PID: {proc.pid}")
-                            proc.kill()
+                        await signal_tree_process(proc, pid_map, "[FORCE KILL]", force=True)
                     except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
                         logger.debug(f"Could not kill process {proc.pid}: {e}")
                 
                 # Final wait
                 try:
-                    psutil.wait_procs(still_alive, timeout=2.0)
+                    await wait_tree_async(parent, still_alive, 2.0)
                 except Exception:
                     pass
         except (KeyboardInterrupt, asyncio.CancelledError):
@@ -1339,6 +1989,46 @@ async def kill_process_tree(pid, timeout=5.0):
         return False
 
 
+def _append_output_tail(buffer, chunk):
+    """Append a chunk to an output buffer, keeping only its tail.
+    
+    The buffer is trimmed once it grows past twice the limit, so trimming
+    cost is amortized over many appends.
+    
+    Args:
+        buffer: bytearray holding captured output
+        chunk: Bytes read from the stream
+    """
+    buffer += chunk
+    if len(buffer) > 2 * MAX_CAPTURED_OUTPUT_BYTES:
+        del buffer[:-MAX_CAPTURED_OUTPUT_BYTES]
+
+
+def _output_tail_bytes(buffer):
+    """Return the last MAX_CAPTURED_OUTPUT_BYTES of a captured output buffer."""
+    # Slicing a memoryview doesn't copy, so the tail is copied only once
+    return bytes(memoryview(buffer)[-MAX_CAPTURED_OUTPUT_BYTES:])
+
+
+async def _read_stream_tail(stream, buffer):
+    """Read a process stream until EOF, keeping only the tail of the output.
+    
+    Args:
+        stream: asyncio StreamReader (process.stdout or process.stderr), may be None
+        buffer: bytearray receiving the output
+    """
+    if not stream:
+        return
+    try:
+        while True:
+            chunk = await stream.read(OUTPUT_READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            _append_output_tail(buffer, chunk)
+    except (asyncio.CancelledError, Exception):
+        pass  # Stream closed, cancelled, or error
+
+
 async def _wait_for_read_task_and_collect_output(read_task, chunks_stdout, chunks_stderr, signal_type="signal"):
     """Wait for read_task to complete and collect output.
     
@@ -1347,8 +2037,8 @@ async def _wait_for_read_task_and_collect_output(read_task, chunks_stdout, chunk
     
     Args:
         read_task: The asyncio task that's reading from process streams
-        chunks_stdout: List of stdout chunks collected so far
-        chunks_stderr: List of stderr chunks collected so far
+        chunks_stdout: bytearray with stdout collected so far
+        chunks_stderr: bytearray with stderr collected so far
         signal_type: Type of signal sent ("timeout" or "interrupt") for logging
     
     Returns:
@@ -1379,8 +2069,8 @@ async def _wait_for_read_task_and_collect_output(read_task, chunks_stdout, chunk
                 pass
     
     # Collect the data (read_task may have continued reading)
-    stdout_bytes = b''.join(chunks_stdout)
-    stderr_bytes = b''.join(chunks_stderr)
+    stdout_bytes = _output_tail_bytes(chunks_stdout)
+    stderr_bytes = _output_tail_bytes(chunks_stderr)
     
     return stdout_bytes, stderr_bytes
 
@@ -1430,92 +2120,139 @@ async def _kill_process_and_read_remaining_output(process, stdout_bytes, stderr_
         else:
             logger.error(f"Error killing process tree: {kill_error}")
     
-    # After killing, try to read any remaining output from streams
+    # After killing, read any remaining output from streams
     # Cleanup handlers might have written to stdout/stderr during cleanup
     # We need to read this output to see cleanup messages
     logger.debug("Reading any remaining output from streams after process kill (cleanup handlers may have written)...")
+    # The kill closed the write ends of the pipes, so both streams are drained to
+    # EOF concurrently; the timeout only matters if a leftover process still holds
+    # a pipe open. Data read before the timeout is kept in the buffers.
+    remaining_stdout = bytearray()
+    remaining_stderr = bytearray()
     try:
-        # Wait longer for cleanup handlers to write output (they might be running)
-        # The cleanup process might take a moment to flush output
-        await asyncio.sleep(2.0)  # Give cleanup handlers time to write
-        
-        # Try to read remaining data from stdout
-        remaining_stdout = b''
-        if process.stdout:
-            try:
-                # Try reading with multiple attempts since data might arrive after cleanup
-                for attempt in range(3):  # Try up to 3 times
-                    try:
-                        # Check if stream is readable
-                        if hasattr(process.stdout, 'at_eof') and process.stdout.at_eof():
-                            break
-                        
-                        chunk = await asyncio.wait_for(process.stdout.read(8192), timeout=1.0)
-                        if not chunk:
-                            # No data yet, wait a bit more if not last attempt
-                            if attempt < 2:
-                                await asyncio.sleep(0.5)
-                                continue
-                            break
-                        remaining_stdout += chunk
-                        # Got some data, continue reading
-                    except (asyncio.TimeoutError, asyncio.CancelledError):
-                        # Timeout or cancelled, might be more data later
-                        if attempt < 2:
-                            await asyncio.sleep(0.5)
-                            continue
-                        break
-                    except Exception as e:
-                        logger.debug(f"Error reading stdout chunk: {e}")
-                        break
-            except Exception as e:
-                logger.debug(f"Error reading remaining stdout: {e}")
-            
-            if remaining_stdout:
-                stdout_bytes += remaining_stdout
-                logger.info(f"Read {len(remaining_stdout)} additional bytes from stdout after kill (likely cleanup handler output)")
-        
-        # Try to read remaining data from stderr
-        remaining_stderr = b''
-        if process.stderr:
-            try:
-                # Try reading with multiple attempts since data might arrive after cleanup
-                for attempt in range(3):  # Try up to 3 times
-                    try:
-                        # Check if stream is readable
-                        if hasattr(process.stderr, 'at_eof') and process.stderr.at_eof():
-                            break
-                        
-                        chunk = await asyncio.wait_for(process.stderr.read(8192), timeout=1.0)
-                        if not chunk:
-                            # No data yet, wait a bit more if not last attempt
-                            if attempt < 2:
-                                await asyncio.sleep(0.5)
-                                continue
-                            break
-                        remaining_stderr += chunk
-                        # Got some data, continue reading
-                    except (asyncio.TimeoutError, asyncio.CancelledError):
-                        # Timeout or cancelled, might be more data later
-                        if attempt < 2:
-                            await asyncio.sleep(0.5)
-                            continue
-                        break
-                    except Exception as e:
-                        logger.debug(f"Error reading stderr chunk: {e}")
-                        break
-            except Exception as e:
-                logger.debug(f"Error reading remaining stderr: {e}")
-            
-            if remaining_stderr:
-                stderr_bytes += remaining_stderr
-                logger.info(f"Read {len(remaining_stderr)} additional bytes from stderr after kill (likely cleanup handler output)")
+        await asyncio.wait_for(
+            asyncio.gather(
+                _read_stream_tail(process.stdout, remaining_stdout),
+                _read_stream_tail(process.stderr, remaining_stderr)
+            ),
+            timeout=REMAINING_OUTPUT_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.debug(f"Streams not closed within {REMAINING_OUTPUT_TIMEOUT}s after kill, keeping what was read")
     except Exception as e:
         logger.debug(f"Error reading remaining output: {e}")
     
+    if remaining_stdout:
+        stdout_bytes += _output_tail_bytes(remaining_stdout)
+        logger.info(f"Read {len(remaining_stdout)} additional bytes from stdout after kill (likely cleanup handler output)")
+    if remaining_stderr:
+        stderr_bytes += _output_tail_bytes(remaining_stderr)
+        logger.info(f"Read {len(remaining_stderr)} additional bytes from stderr after kill (likely cleanup handler output)")
+    
     return stdout_bytes, stderr_bytes
 
 
+def get_script_semaphore(context):
+    """Get the semaphore limiting how many scripts run at the same time.
+    
+    Media groups are processed in background tasks, so several uploads can
+    otherwise start scripts (and their yt-dlp/ffmpeg/nak children) at once.
+    The semaphore is created on first use, inside the running event loop, and
+    recreated when a /reload changes max_concurrent_scripts (scripts already
+    running keep the slot they hold in the old one).
+    
+    Args:
+        context: Handler context (its bot_data holds the config and semaphore)
+    
+    Returns:
+        asyncio.Semaphore sized by the max_concurrent_scripts setting
+    """
+    config = context.bot_data.get('config') or {}
+    size = config.get('max_concurrent_scripts') or os.cpu_count() or 4
+    semaphore = context.bot_data.get('script_semaphore')
+    if semaphore is None or context.bot_data.get('script_semaphore_size') != size:
+        semaphore = asyncio.Semaphore(size)
+        context.bot_data['script_semaphore'] = semaphore
+        context.bot_data['script_semaphore_size'] = size
+    return semaphore
+
+
+async def interrupt_script(process, label, signal_children=False, kill_timeout=1.0):
+    """Send SIGINT to a running script, matching Control-C.
+    
+    On Linux the script's process group is signalled. Subprocesses launched via
+    bash.exe are always Cygwin processes, so on Cygwin (and native Windows) the
+    script is signalled by its Cygwin PID instead, optionally followed by its
+    children (they might not inherit the signal), with os.kill() as the fallback.
+    
+    Args:
+        process: asyncio subprocess running the script
+        label: Log prefix naming the caller, e.g. "[TIMEOUT SIGNAL]"
+        signal_children: Also signal the script's child processes (Cygwin only)
+        kill_timeout: Time to wait for the Cygwin kill command (seconds)
+    
+    Raises:
+        ProcessLookupError: If the script has already exited
+        OSError: If the signal could not be sent
+    """
+    if not (os.name == 'nt' or IS_CYGWIN):
+        # Linux: try process group first, fallback to process
+        try:
+            pgid = os.getpgid(process.pid)
+            logger.warning("%s Platform: Linux | Method: os.killpg() (SIGINT to process group) | PID: %s | Process Group: %s", label, process.pid, pgid)
+            os.killpg(pgid, signal.SIGINT)
+        except (ProcessLookupError, OSError) as pg_err:
+            # Fallback: send to process directly if process group fails
+            logger.warning("%s Platform: Linux | Method: os.kill() (SIGINT to process, fallback - process group failed: %s) | PID: %s", label, pg_err, process.pid)
+            os.kill(process.pid, signal.SIGINT)
+        return
+    
+    # Cygwin: map Windows PID to Cygwin PID, then signal it
+    # One ps listing maps the parent and all its children
+    pid_map = await get_cygwin_pid_map() if IS_CYGWIN else None
+    cygwin_pid = await get_cygwin_pid(process.pid, pid_map)
+    if not cygwin_pid:
+        # Could not map PID, fallback to os.kill
+        logger.warning("%s Platform: Cygwin | Method: os.kill() (fallback - PID mapping failed) | Windows PID: %s", label, process.pid)
+        os.kill(process.pid, signal.SIGINT)
+        return
+    
+    try:
+        logger.warning("%s Platform: Cygwin | Method: Cygwin SIGINT (os.kill/kill) | Windows PID: %s -> Cygwin PID: %s", label, process.pid, cygwin_pid)
+        await send_cygwin_signal(cygwin_pid, signal.SIGINT, timeout=kill_timeout)
+        logger.debug("Sent SIGINT to process (Windows PID %s, Cygwin PID %s) via Cygwin signal", process.pid, cygwin_pid)
+    except (asyncio.TimeoutError, FileNotFoundError) as kill_err:
+        # Fallback to os.kill if kill command fails
+        logger.warning("%s Platform: Cygwin | Method: os.kill() (fallback - kill command failed: %s) | Windows PID: %s", label, kill_err, process.pid)
+        os.kill(process.pid, signal.SIGINT)
+        return
+    
+    # Also send SIGINT to all child processes (they might not inherit the signal)
+    if signal_children and PSUTIL_AVAILABLE:
+        try:
+            children = psutil.Process(process.pid).children(recursive=True)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            # Parent or children might have already exited
+            return
+        if children:
+            logger.info("Sending SIGINT to %s child process(es) via Cygwin signal...", len(children))
+            child_cygwin_pids = []
+            for child in children:
+                child_cygwin_pid = await get_cygwin_pid(child.pid, pid_map)
+                if child_cygwin_pid:
+                    logger.warning("%s Platform: Cygwin | Method: Cygwin SIGINT (os.kill/kill) | Child Windows PID: %s -> Cygwin PID: %s", label, child.pid, child_cygwin_pid)
+                    child_cygwin_pids.append(child_cygwin_pid)
+                else:
+                    logger.warning("Could not map child Windows PID %s to Cygwin PID, skipping", child.pid)
+            # All children are signalled together (at most one kill command)
+            try:
+                await send_cygwin_signal(child_cygwin_pids, signal.SIGINT, timeout=kill_timeout)
+                logger.debug("Sent SIGINT to child processes (Cygwin PIDs %s) via Cygwin signal", child_cygwin_pids)
+            except (asyncio.TimeoutError, FileNotFoundError) as child_err:
+                # Children might have already exited
+                logger.debug("Error sending SIGINT to child processes %s: %s", child_cygwin_pids, child_err)
+
+
 async def execute_script(cmd, cwd=None, timeout=None):
     """Execute the script and capture output.
     
@@ -1530,10 +2267,11 @@ async def execute_script(cmd, cwd=None, timeout=None):
     process = None
     try:
         # Log full command for debugging
-        logger.info(f"Executing command: {cmd}")
-        logger.info(f"Command string: {' '.join(str(arg) for arg in cmd)}")
+        logger.info("Executing command: %s", cmd)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Command string: %s", ' '.join(map(str, cmd)))
         if timeout:
-            logger.info(f"Timeout set to {timeout} seconds")
+            logger.info("Timeout set to %s seconds", timeout)
         
         # Validate first argument (executable) exists if it's an absolute path
         executable = cmd[0] if cmd else None
@@ -1565,299 +2303,147 @@ async def execute_script(cmd, cwd=None, timeout=None):
                 startupinfo=startupinfo
             )
         else:
-            # On Unix, try to create process in its own process group (like a foreground process)
-            # This allows SIGINT to work exactly like Control-C
-            # Note: Cygwin has limited process group support, so we handle it gracefully
-            def preexec_fn():
-                # Create new process group (like a foreground process)
-                # On Cygwin, this might not work or work differently
-                try:
-                    os.setsid()
-                except OSError:
-                    # On Cygwin, setsid might not be available or work differently
-                    # Just continue without it - we'll send signals directly
-                    pass
-            
+            # On Unix, create the process in its own session and process group (like a
+            # foreground process), so one killpg() signals the whole tree exactly like Control-C.
+            # start_new_session runs setsid() in the child without a Python preexec_fn,
+            # which keeps the fast vfork/posix_spawn path available.
+            # Note: Cygwin has limited process group support, so we skip it there
+            # and send signals directly
             process = await asyncio.create_subprocess_exec(
                 *cmd,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
                 cwd=cwd or Path(__file__).parent,
-                preexec_fn=preexec_fn if not IS_CYGWIN else None  # Skip on Cygwin
+                start_new_session=not IS_CYGWIN
             )
         
         # Track the process for cleanup on shutdown
         if process and process.pid:
             running_processes[process.pid] = {'process': process, 'cmd': cmd}
-            logger.debug(f"Tracking process PID {process.pid}: {cmd[0]}")
+            logger.debug("Tracking process PID %s: %s", process.pid, cmd[0])
         
         # Wait for process completion with optional timeout
         stdout_bytes = b''
         stderr_bytes = b''
         timed_out = False
         interrupt_reason = None  # Store reason for error message formatting
+        cancelled = None  # CancelledError to re-raise once the script is stopped
         
-        if timeout:
-            # Use manual stream reading to capture partial output on timeout
-            chunks_stdout = []
-            chunks_stderr = []
+        # Read both streams manually (keeping only the tail of very verbose output) so
+        # partial output is captured on timeout or cancellation. Without a timeout,
+        # asyncio.wait() below simply waits for the script, but cancellation still
+        # stops it the same way
+        chunks_stdout = bytearray()
+        chunks_stderr = bytearray()
+        
+        async def read_streams():
+            """Read from both streams concurrently while waiting for process."""
+            stream_tasks = []
             
-            async def read_streams():
-                """Read from both streams concurrently while waiting for process."""
-                nonlocal chunks_stdout, chunks_stderr
-                
-                stream_tasks = []
-                
-                async def read_stdout():
-                    if process.stdout:
-                        try:
-                            while True:
-                                chunk = await process.stdout.read(8192)
-                                if not chunk:
-                                    break
-                                chunks_stdout.append(chunk)
-                        except (asyncio.CancelledError, Exception):
-                            pass  # Stream closed, cancelled, or error
-                
-                async def read_stderr():
-                    if process.stderr:
-                        try:
-                            while True:
-                                chunk = await process.stderr.read(8192)
-                                if not chunk:
-                                    break
-                                chunks_stderr.append(chunk)
-                        except (asyncio.CancelledError, Exception):
-                            pass  # Stream closed, cancelled, or error
-                
-                # Start reading streams and waiting for process concurrently
-                if process.stdout:
-                    stream_tasks.append(asyncio.create_task(read_stdout()))
-                if process.stderr:
-                    stream_tasks.append(asyncio.create_task(read_stderr()))
-                
-                try:
-                    # Wait for process to finish
-                    await process.wait()
-                    
-                    # Wait for streams to finish reading (they'll hit EOF)
-                    if stream_tasks:
-                        await asyncio.gather(*stream_tasks, return_exceptions=True)
-                except asyncio.CancelledError:
-                    # If read_streams is cancelled, cancel all stream tasks
-                    for task in stream_tasks:
-                        if not task.done():
-                            task.cancel()
-                    # Wait for stream tasks to finish cancelling
-                    if stream_tasks:
-                        await asyncio.gather(*stream_tasks, return_exceptions=True)
-                    raise
+            # Start reading streams and waiting for process concurrently
+            if process.stdout:
+                stream_tasks.append(asyncio.create_task(_read_stream_tail(process.stdout, chunks_stdout)))
+            if process.stderr:
+                stream_tasks.append(asyncio.create_task(_read_stream_tail(process.stderr, chunks_stderr)))
             
-            # Use timeout-aware approach: send signal before cancelling, matching Control-C behavior
             try:
-                # Create a timeout task that sends SIGINT (matching Control-C) when timeout is reached
-                async def send_timeout_signal():
-                    await asyncio.sleep(timeout)
-                    # Timeout reached - send SIGINT to process (matching Control-C exactly)
-                    if process and process.pid:
-                        try:
-                            # On Windows, subprocesses launched via bash.exe are ALWAYS Cygwin processes
-                            # So we should use Cygwin kill methods, not Windows methods
-                            if os.name == 'nt' or IS_CYGWIN:
-                                    # Cygwin: map Windows PID to Cygwin PID, then use kill command
-                                    # Send to parent first, then get all children and send to them too
-                                    # This ensures all processes in the tree receive the signal
-                                    try:
-                                        # Map parent Windows PID to Cygwin PID
-                                        cygwin_pid = await get_cygwin_pid(process.pid)
-                                        if cygwin_pid:
-                                            # Send SIGINT to parent process
-                                            logger.warning(f"[TIMEOUT SIGNAL] Platform: Cygwin | Method: 'kill -INT' command | Windows PID: {process.pid} -> Cygwin PID: {cygwin_pid}")
-                                            kill_proc = await asyncio.create_subprocess_exec(
-                                                'kill', '-INT', str(cygwin_pid),
-                                                stdout=asyncio.subprocess.DEVNULL,
-                                                stderr=asyncio.subprocess.DEVNULL
-                                            )
-                                            await asyncio.wait_for(kill_proc.wait(), timeout=2.0)
-                                            logger.debug(f"Timeout reached ({timeout}s), sent SIGINT to parent process (Windows PID {process.pid}, Cygwin PID {cygwin_pid}) via Cygwin kill command")
-                                            
-                                            # Also send SIGINT to all child processes (they might not inherit the signal)
-                                            if PSUTIL_AVAILABLE:
-                                                try:
-                                                    parent_proc = psutil.Process(process.pid)
-                                                    children = parent_proc.children(recursive=True)
-                                                    if children:
-                                                        logger.info(f"Sending SIGINT to {len(children)} child process(es) via Cygwin kill command...")
-                                                        for child in children:
-                                                            try:
-                                                                child_cygwin_pid = await get_cygwin_pid(child.pid)
-                                                                if child_cygwin_pid:
-                                                                    logger.warning(f"[TIMEOUT SIGNAL] Platform: Cygwin | Method: 'kill -INT' command | Child Windows PID: {child.pid} -> Cygwin PID: {child_cygwin_pid}")
-                                                                    child_kill_proc = await asyncio.create_subprocess_exec(
-                                                                        'kill', '-INT', str(child_cygwin_pid),
-                                                                        stdout=asyncio.subprocess.DEVNULL,
-                                                                        stderr=asyncio.subprocess.DEVNULL
-                                                                    )
-                                                                    await asyncio.wait_for(child_kill_proc.wait(), timeout=1.0)
-                                                                    logger.debug(f"Sent SIGINT to child process (Windows PID {child.pid}, Cygwin PID {child_cygwin_pid}) via Cygwin kill command")
-                                                                else:
-                                                                    logger.warning(f"Could not map child Windows PID {child.pid} to Cygwin PID, skipping")
-                                                            except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as child_err:
-                                                                # Child might have already exited
-                                                                logger.debug(f"Error sending SIGINT to child process {child.pid}: {child_err}")
-                                                                pass
-                                                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                                                    # Parent or children might have already exited
-                                                    pass
-                                            
-                                            logger.debug(f"Timeout reached ({timeout}s), sent SIGINT to process tree starting at Windows PID {process.pid} (Cygwin PID {cygwin_pid}) via Cygwin kill command (matching Control-C)")
-                                        else:
-                                            # Could not map PID, fallback to os.kill
-                                            logger.warning(f"[TIMEOUT SIGNAL] Platform: Cygwin | Method: os.kill() (fallback - PID mapping failed) | Windows PID: {process.pid}")
-                                            os.kill(process.pid, signal.SIGINT)
-                                    except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as kill_err:
-                                        # Fallback to os.kill if kill command fails
-                                        logger.warning(f"[TIMEOUT SIGNAL] Platform: Cygwin (Windows subprocess) | Method: os.kill() (fallback - kill command failed: {kill_err}) | Windows PID: {process.pid}")
-                                        os.kill(process.pid, signal.SIGINT)
-                            else:
-                                # Linux: try process group first, fallback to process
-                                try:
-                                    pgid = os.getpgid(process.pid)
-                                    logger.warning(f"[TIMEOUT SIGNAL] Platform: Linux | Method: os.killpg() (SIGINT to process group) | PID: {process.pid} | Process Group: {pgid}")
-                                    os.killpg(pgid, signal.SIGINT)
-                                except (ProcessLookupError, OSError) as pg_err:
-                                    # Fallback: send to process directly if process group fails
-                                    logger.warning(f"[TIMEOUT SIGNAL] Platform: Linux | Method: os.kill() (SIGINT to process, fallback - process group failed: {pg_err}) | PID: {process.pid}")
-                                    os.kill(process.pid, signal.SIGINT)
-                        except (ProcessLookupError, psutil.NoSuchProcess, psutil.AccessDenied) as sig_err:
-                            logger.debug(f"Process already gone or cannot send signal: {sig_err}")
-                        except Exception as sig_err:
-                            logger.warning(f"Error sending timeout signal: {sig_err}")
-                
-                # Start both tasks concurrently
-                timeout_task = asyncio.create_task(send_timeout_signal())
-                read_task = asyncio.create_task(read_streams())
-                
-                # Wait for either to complete first
-                done, pending = await asyncio.wait(
-                    [timeout_task, read_task],
-                    return_when=asyncio.FIRST_COMPLETED
-                )
-                
-                # Determine what happened
-                if timeout_task in done:
-                    # Timeout occurred - signal already sent
-                    timed_out = True
-                    interrupt_reason = ("timeout", f"timed out after {timeout} seconds")
-                    logger.warning(f"Script execution {interrupt_reason[1]}, signal sent, waiting for cleanup handlers and process exit...")
-                    
-                    # Signal was sent (SIGINT matching Control-C), now wait for process to handle it and exit
-                    # read_task is still running and will complete when process exits
-                    # Use the same helper function for both timeout and interrupt
-                    stdout_bytes, stderr_bytes = await _wait_for_read_task_and_collect_output(
-                        read_task, chunks_stdout, chunks_stderr, signal_type="timeout"
-                    )
-                elif read_task in done:
-                    # Normal completion - process finished before timeout
-                    timed_out = False
-                    # Cancel timeout task since we don't need it anymore
-                    timeout_task.cancel()
-                    try:
-                        await timeout_task
-                    except (asyncio.CancelledError, KeyboardInterrupt):
-                        pass
-                    
-                    # Collect the data (read_task already completed)
-                    stdout_bytes = b''.join(chunks_stdout)
-                    stderr_bytes = b''.join(chunks_stderr)
-                
-            except KeyboardInterrupt as e:
-                # KeyboardInterrupt occurred (user pressed Control-C)
-                # On Windows, subprocesses launched via bash.exe are ALWAYS Cygwin processes
-                # So we should use Cygwin kill methods, not Windows methods
-                # Send SIGINT to match Control-C behavior, but use shorter wait times since user wants quick shutdown
-                timed_out = True
-                interrupt_reason = ("interrupt", "interrupted by KeyboardInterrupt (Ctrl+C)")
-                logger.warning(f"Script execution {interrupt_reason[1]}, sending signal...")
-                
-                # Cancel timeout task if it's still running
-                if 'timeout_task' in locals():
-                    timeout_task.cancel()
-                    try:
-                        await timeout_task
-                    except (asyncio.CancelledError, KeyboardInterrupt):
-                        pass
+                # Wait for process to finish
+                await process.wait()
                 
-                # Send SIGINT to process (matching Control-C) - same as timeout but with shorter wait
+                # Wait for streams to finish reading (they'll hit EOF)
+                if stream_tasks:
+                    await asyncio.gather(*stream_tasks, return_exceptions=True)
+            except asyncio.CancelledError:
+                # If read_streams is cancelled, cancel all stream tasks
+                for task in stream_tasks:
+                    if not task.done():
+                        task.cancel()
+                # Wait for stream tasks to finish cancelling
+                if stream_tasks:
+                    await asyncio.gather(*stream_tasks, return_exceptions=True)
+                raise
+        
+        # Use timeout-aware approach: send signal before cancelling, matching Control-C behavior
+        try:
+            # Read until the process exits or the timeout expires (0 or None means no timeout;
+            # asyncio.wait() does not cancel read_task when the timeout expires)
+            read_task = asyncio.create_task(read_streams())
+            done, pending = await asyncio.wait([read_task], timeout=timeout or None)
+            
+            # Determine what happened
+            if read_task not in done:
+                # Timeout occurred - send SIGINT to the process tree (matching Control-C exactly)
                 if process and process.pid:
                     try:
-                        if os.name == 'nt' or IS_CYGWIN:
-                            # Cygwin: map Windows PID to Cygwin PID, then use kill command
-                            cygwin_pid = await get_cygwin_pid(process.pid)
-                            if cygwin_pid:
-                                try:
-                                    logger.warning(f"[INTERRUPT SIGNAL] Platform: Cygwin (Windows subprocess) | Method: 'kill -INT' command | Windows PID: {process.pid} -> Cygwin PID: {cygwin_pid}")
-                                    kill_proc = await asyncio.create_subprocess_exec(
-                                        'kill', '-INT', str(cygwin_pid),
-                                        stdout=asyncio.subprocess.DEVNULL,
-                                        stderr=asyncio.subprocess.DEVNULL
-                                    )
-                                    await asyncio.wait_for(kill_proc.wait(), timeout=1.0)
-                                    logger.debug(f"Sent SIGINT to process (Windows PID {process.pid}, Cygwin PID {cygwin_pid}) via Cygwin kill command")
-                                except (asyncio.TimeoutError, FileNotFoundError, ProcessLookupError) as kill_err:
-                                    # Fallback to os.kill if kill command fails
-                                    logger.warning(f"[INTERRUPT SIGNAL] Platform: Cygwin (Windows subprocess) | Method: os.kill() (fallback - kill command failed: {kill_err}) | Windows PID: {process.pid}")
-                                    try:
-                                        os.kill(process.pid, signal.SIGINT)
-                                    except (ProcessLookupError, OSError):
-                                        pass
-                            else:
-                                # Could not map PID, fallback to os.kill
-                                logger.warning(f"[INTERRUPT SIGNAL] Platform: Cygwin (Windows subprocess) | Method: os.kill() (fallback - PID mapping failed) | Windows PID: {process.pid}")
-                                try:
-                                    os.kill(process.pid, signal.SIGINT)
-                                except (ProcessLookupError, OSError):
-                                    pass
-                        else:
-                            # Linux: try process group first, fallback to process
-                            try:
-                                pgid = os.getpgid(process.pid)
-                                logger.warning(f"[INTERRUPT SIGNAL] Platform: Linux | Method: os.killpg() (SIGINT to process group) | PID: {process.pid} | Process Group: {pgid}")
-                                os.killpg(pgid, signal.SIGINT)
-                            except (ProcessLookupError, OSError) as pg_err:
-                                # Fallback: send to process directly if process group fails
-                                logger.warning(f"[INTERRUPT SIGNAL] Platform: Linux | Method: os.kill() (SIGINT to process, fallback - process group failed: {pg_err}) | PID: {process.pid}")
-                                try:
-                                    os.kill(process.pid, signal.SIGINT)
-                                except (ProcessLookupError, OSError):
-                                    pass
-                    except (ProcessLookupError, OSError) as sig_err:
-                        logger.debug(f"Process already gone or cannot send signal: {sig_err}")
+                        await interrupt_script(process, "[TIMEOUT SIGNAL]", signal_children=True, kill_timeout=2.0)
+                    except ProcessLookupError as sig_err:
+                        logger.debug("Process already gone or cannot send signal: %s", sig_err)
+                    except Exception as sig_err:
+                        logger.warning("Error sending timeout signal: %s", sig_err)
+                timed_out = True
+                interrupt_reason = ("timeout", f"timed out after {timeout} seconds")
+                logger.warning("Script execution %s, signal sent, waiting for cleanup handlers and process exit...", interrupt_reason[1])
                 
-                logger.warning(f"Script execution {interrupt_reason[1]}, signal sent, waiting for cleanup handlers and process exit (short timeout for quick shutdown)...")
+                # Signal was sent (SIGINT matching Control-C), now wait for process to handle it and exit
+                # read_task is still running and will complete when process exits
+                # Use the same helper function for both timeout and interrupt
+                stdout_bytes, stderr_bytes = await _wait_for_read_task_and_collect_output(
+                    read_task, chunks_stdout, chunks_stderr, signal_type="timeout"
+                )
+            else:
+                # Normal completion - process finished before timeout
+                timed_out = False
                 
-                # Wait for read_task to complete (use shorter timeout for interrupts)
-                # read_task should still be running and will complete when process exits
-                if 'read_task' in locals():
-                    stdout_bytes, stderr_bytes = await _wait_for_read_task_and_collect_output(
-                        read_task, chunks_stdout, chunks_stderr, signal_type="interrupt"
-                    )
-                else:
-                    # read_task wasn't created yet, just collect what we have
-                    stdout_bytes = b''.join(chunks_stdout)
-                    stderr_bytes = b''.join(chunks_stderr)
+                # Collect the data (read_task already completed)
+                stdout_bytes = _output_tail_bytes(chunks_stdout)
+                stderr_bytes = _output_tail_bytes(chunks_stderr)
+            
+        except (KeyboardInterrupt, asyncio.CancelledError) as e:
+            # KeyboardInterrupt occurred (user pressed Control-C), or the task running the
+            # script was cancelled (e.g. during shutdown); both get the same cleanup
+            # On Windows, subprocesses launched via bash.exe are ALWAYS Cygwin processes
+            # So we should use Cygwin kill methods, not Windows methods
+            # Send SIGINT to match Control-C behavior, but use shorter wait times since user wants quick shutdown
+            timed_out = True
+            if isinstance(e, asyncio.CancelledError):
+                cancelled = e
+                interrupt_reason = ("cancelled", "cancelled")
+            else:
+                interrupt_reason = ("interrupt", "interrupted by KeyboardInterrupt (Ctrl+C)")
+            logger.warning("Script execution %s, sending signal...", interrupt_reason[1])
+            
+            # Send SIGINT to process (matching Control-C) - same as timeout but with shorter wait
+            if process and process.pid:
+                try:
+                    await interrupt_script(process, "[INTERRUPT SIGNAL]")
+                except (ProcessLookupError, OSError) as sig_err:
+                    logger.debug("Process already gone or cannot send signal: %s", sig_err)
+            
+            logger.warning("Script execution %s, signal sent, waiting for cleanup handlers and process exit (short timeout for quick shutdown)...", interrupt_reason[1])
             
-            # If timed out/interrupted and process is still running, force kill and read remaining output
-            # This is the same for both timeout and KeyboardInterrupt
-            if timed_out and process and process.returncode is None:
-                # Process didn't exit after signal, need to force kill and read remaining output
-                logger.debug("Process still running after signal and wait, force killing and reading remaining output...")
-                stdout_bytes, stderr_bytes = await _kill_process_and_read_remaining_output(
-                    process, stdout_bytes, stderr_bytes
+            # Wait for read_task to complete (use shorter timeout for interrupts)
+            # read_task should still be running and will complete when process exits
+            if 'read_task' in locals():
+                stdout_bytes, stderr_bytes = await _wait_for_read_task_and_collect_output(
+                    read_task, chunks_stdout, chunks_stderr, signal_type="interrupt"
                 )
-        else:
-            # No timeout - use standard communicate
-            stdout_bytes, stderr_bytes = await process.communicate()
+            else:
+                # read_task wasn't created yet, just collect what we have
+                stdout_bytes = _output_tail_bytes(chunks_stdout)
+                stderr_bytes = _output_tail_bytes(chunks_stderr)
+        
+        # If timed out/interrupted and process is still running, force kill and read remaining output
+        # This is the same for both timeout and KeyboardInterrupt
+        if timed_out and process and process.returncode is None:
+            # Process didn't exit after signal, need to force kill and read remaining output
+            logger.debug("Process still running after signal and wait, force killing and reading remaining output...")
+            stdout_bytes, stderr_bytes = await _kill_process_and_read_remaining_output(
+                process, stdout_bytes, stderr_bytes
+            )
+        
+        # The script has been stopped; let the cancellation continue
+        if cancelled:
+            raise cancelled
         
         # Decode bytes to strings
         stdout = stdout_bytes.decode('utf-8', errors='replace') if stdout_bytes else ''
@@ -1871,7 +2457,7 @@ async def execute_script(cmd, cwd=None, timeout=None):
         # Remove process from tracking when it finishes
         if process and process.pid and process.pid in running_processes:
             del running_processes[process.pid]
-            logger.debug(f"Removed process PID {process.pid} from tracking")
+            logger.debug("Removed process PID %s from tracking", process.pid)
         
         # Close process streams to avoid unclosed transport warnings
         # This is especially important on Windows with ProactorEventLoop
@@ -1883,14 +2469,14 @@ async def execute_script(cmd, cwd=None, timeout=None):
                     try:
                         process.stdout.close()
                     except (RuntimeError, OSError, ValueError) as close_err:
-                        logger.debug(f"Error closing stdout stream: {close_err}")
+                        logger.debug("Error closing stdout stream: %s", close_err)
                 if process.stderr:
                     try:
                         process.stderr.close()
                     except (RuntimeError, OSError, ValueError) as close_err:
-                        logger.debug(f"Error closing stderr stream: {close_err}")
+                        logger.debug("Error closing stderr stream: %s", close_err)
         except Exception as e:
-            logger.debug(f"Error closing process streams: {e}")
+            logger.debug("Error closing process streams: %s", e)
         
         if timed_out:
             # Determine the appropriate error message based on the reason
@@ -1911,10 +2497,6 @@ async def execute_script(cmd, cwd=None, timeout=None):
                 error_msg = f"Script execution timed out after {timeout} seconds"
                 output_label = "before timeout"
             
-            # Sanitize output before using it (in case it wasn't sanitized yet)
-            stdout = sanitize_subprocess_output(stdout) if stdout else ''
-            stderr = sanitize_subprocess_output(stderr) if stderr else ''
-            
             # Prepend error message to stderr, but keep any captured output
             if stderr:
                 # Check if error message is already in stderr (from cleanup handlers)
@@ -1934,13 +2516,13 @@ async def execute_script(cmd, cwd=None, timeout=None):
             }
         
         # Log captured output for debugging (output is already sanitized)
-        logger.debug(f"Script returncode: {process.returncode}")
-        logger.debug(f"Script stdout length: {len(stdout)} bytes")
-        logger.debug(f"Script stderr length: {len(stderr)} bytes")
+        logger.debug("Script returncode: %s", process.returncode)
+        logger.debug("Script stdout length: %s bytes", len(stdout))
+        logger.debug("Script stderr length: %s bytes", len(stderr))
         if stdout:
-            logger.debug(f"Script stdout (first 500 chars): {stdout[:500]}")
+            logger.debug("Script stdout (first 500 chars): %s", stdout[:500])
         if stderr:
-            logger.debug(f"Script stderr (first 500 chars): {stderr[:500]}")
+            logger.debug("Script stderr (first 500 chars): %s", stderr[:500])
         
         return {
             'returncode': process.returncode,
@@ -1949,7 +2531,7 @@ async def execute_script(cmd, cwd=None, timeout=None):
             'success': process.returncode == 0
         }
     except Exception as e:
-        logger.exception(f"Exception while executing script: {e}")
+        logger.exception("Exception while executing script: %s", e)
         # Make sure to kill the process tree if it's still running
         if process and process.returncode is None:
             try:
@@ -1963,7 +2545,7 @@ async def execute_script(cmd, cwd=None, timeout=None):
                     process.kill()
                     await process.wait()
             except Exception as e:
-                logger.debug(f"Error cleaning up process: {e}")
+                logger.debug("Error cleaning up process: %s", e)
         # Ensure streams are closed even on exception
         try:
             if process:
@@ -1986,6 +2568,12 @@ async def execute_script(cmd, cwd=None, timeout=None):
             'success': False
         }
     finally:
+        # Stop tracking the process once it has exited, whichever path got here (the
+        # exception handler only untracks processes it had to kill). Processes still
+        # running, e.g. when the task is cancelled, stay tracked for shutdown cleanup
+        if process is not None and process.returncode is not None:
+            running_processes.pop(process.pid, None)
+        
         # Always ensure streams are closed, even if function returns early or raises
         # This is critical on Windows with ProactorEventLoop to avoid "Event loop is closed" errors
         # On Windows ProactorEventLoop, close() schedules async close operations
@@ -2003,9 +2591,9 @@ async def execute_script(cmd, cwd=None, timeout=None):
                         # Event loop is closed - this is expected when shutting down
                         # The stream will be cleaned up by the garbage collector
                         if "Event loop is closed" not in str(close_err):
-                            logger.debug(f"Error closing stdout in finally: {close_err}")
+                            logger.debug("Error closing stdout in finally: %s", close_err)
                     except (OSError, ValueError, AttributeError) as close_err:
-                        logger.debug(f"Error closing stdout in finally: {close_err}")
+                        logger.debug("Error closing stdout in finally: %s", close_err)
                         pass  # Stream might already be closed
                 # Close stderr stream
                 if process.stderr:
@@ -2015,9 +2603,9 @@ async def execute_script(cmd, cwd=None, timeout=None):
                         # Event loop is closed - this is expected when shutting down
                         # The stream will be cleaned up by the garbage collector
                         if "Event loop is closed" not in str(close_err):
-                            logger.debug(f"Error closing stderr in finally: {close_err}")
+                            logger.debug("Error closing stderr in finally: %s", close_err)
                     except (OSError, ValueError, AttributeError) as close_err:
-                        logger.debug(f"Error closing stderr in finally: {close_err}")
+                        logger.debug("Error closing stderr in finally: %s", close_err)
                         pass  # Stream might already be closed
             except Exception as cleanup_err:
                 # Ignore all errors in finally block - we're just trying to clean up
@@ -2044,6 +2632,74 @@ def get_split_group_key(message, caption: str) -> Optional[tuple]:
     return (chat_id, caption_hash)
 
 
+async def sleep_until_deadline(pending, key):
+    """Sleep until the 'deadline' of a pending group, following any resets.
+    
+    New messages push the deadline back instead of cancelling and recreating
+    the waiting task, so each group has a single timeout task.
+    
+    Args:
+        pending: pending_media_groups or pending_split_groups
+        key: Key of the group in pending
+    
+    Returns:
+        The group's data once its deadline has passed, or None if it was removed meanwhile
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        group_data = pending.get(key)
+        if group_data is None:
+            return None
+        delay = group_data['deadline'] - loop.time()
+        if delay <= 0:
+            return group_data
+        await asyncio.sleep(delay)
+
+
+async def process_media_group_after_timeout(media_group_id: str, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Process a pending media group once no message has arrived for MEDIA_GROUP_TIMEOUT seconds.
+    
+    Args:
+        media_group_id: The media group ID
+        context: Bot context
+    """
+    try:
+        group_data = await sleep_until_deadline(pending_media_groups, media_group_id)
+        if group_data is not None and not group_data.get('processed', False):
+            group_data['processed'] = True
+            # Get channel_config from stored group data
+            channel_cfg = group_data.get('channel_config')
+            await process_media_group(media_group_id, group_data['messages'], context, channel_cfg)
+            # Clean up
+            del pending_media_groups[media_group_id]
+    except asyncio.CancelledError:
+        # Task was cancelled (e.g. on shutdown)
+        pass
+    except Exception as e:
+        logger.exception("Error in media group timeout task: %s", e)
+        # Clean up on error
+        if media_group_id in pending_media_groups:
+            del pending_media_groups[media_group_id]
+
+
+async def process_split_groups_after_timeout(split_key: tuple, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Process a pending split group once no group has joined it for SPLIT_GROUP_TIMEOUT seconds.
+    
+    Args:
+        split_key: The split group key (chat_id, caption_hash)
+        context: Bot context
+    """
+    try:
+        if await sleep_until_deadline(pending_split_groups, split_key) is not None:
+            await process_split_groups(split_key, context)
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        logger.exception("Error in split group timeout task: %s", e)
+        if split_key in pending_split_groups:
+            del pending_split_groups[split_key]
+
+
 async def process_split_groups(split_key: tuple, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Process all media groups in a split group together.
     
@@ -2121,7 +2777,7 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
         if first_message.from_user:
             is_owner = (first_message.from_user.id == config['owner_id'])
             if not is_owner:
-                logger.info(f"Media group from non-owner user {first_message.from_user.id}, ignoring")
+                logger.info("Media group from non-owner user %s, ignoring", first_message.from_user.id)
                 return
             
             chat_id = first_message.chat.id if first_message.chat.id else None
@@ -2159,7 +2815,7 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
     # Collect caption from the first message (Telegram usually puts caption on first message)
     text = first_message.caption or first_message.text or ""
     
-    logger.info(f"Processing media group {media_group_id} with {len(messages)} message(s)")
+    logger.info("Processing media group %s with %s message(s)", media_group_id, len(messages))
     
     # Check for split groups: if we have a caption and this is not already a split group,
     # check if this might be part of a split group or start a new split group tracker
@@ -2176,53 +2832,23 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
                         'media_group_id': media_group_id,
                         'messages': messages
                     })
-                    logger.info(f"Added media group {media_group_id} to split group {split_key} (total groups: {len(split_data['groups'])})")
-                    
-                    # Cancel previous timeout and create new one (reset timeout)
-                    if 'task' in split_data and not split_data['task'].done():
-                        try:
-                            split_data['task'].cancel()
-                        except Exception as e:
-                            logger.warning(f"Error cancelling split group timeout task: {e}")
+                    logger.info("Added media group %s to split group %s (total groups: %s)", media_group_id, split_key, len(split_data['groups']))
                     
-                    # Create new timeout task
-                    async def process_split_after_timeout():
-                        try:
-                            await asyncio.sleep(SPLIT_GROUP_TIMEOUT)
-                            if split_key in pending_split_groups:
-                                await process_split_groups(split_key, context)
-                        except asyncio.CancelledError:
-                            pass
-                        except Exception as e:
-                            logger.exception(f"Error in split group timeout task: {e}")
-                            if split_key in pending_split_groups:
-                                del pending_split_groups[split_key]
-                    
-                    split_data['task'] = asyncio.create_task(process_split_after_timeout())
+                    # Reset the timeout; the pending task picks up the new deadline
+                    split_data['deadline'] = asyncio.get_running_loop().time() + SPLIT_GROUP_TIMEOUT
                     # Return early - don't download yet, wait for more groups
                     return
             else:
                 # Create new split group tracker
-                logger.info(f"Starting new split group {split_key} with media group {media_group_id} (caption detected)")
-                
-                async def process_split_after_timeout():
-                    try:
-                        await asyncio.sleep(SPLIT_GROUP_TIMEOUT)
-                        if split_key in pending_split_groups:
-                            await process_split_groups(split_key, context)
-                    except asyncio.CancelledError:
-                        pass
-                    except Exception as e:
-                        logger.exception(f"Error in split group timeout task: {e}")
-                        if split_key in pending_split_groups:
-                            del pending_split_groups[split_key]
+                logger.info("Starting new split group %s with media group %s (caption detected)", split_key, media_group_id)
                 
                 pending_split_groups[split_key] = {
                     'groups': [{
                         'media_group_id': media_group_id,
                         'messages': messages
                     }],
-                    'task': asyncio.create_task(process_split_after_timeout()),
+                    'task': asyncio.create_task(process_split_groups_after_timeout(split_key, context)),
+                    'deadline': asyncio.get_running_loop().time() + SPLIT_GROUP_TIMEOUT,
                     'processed': False,
                     'channel_config': channel_config
                 }
@@ -2230,20 +2856,17 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
                 return
     
     # Collect all media files from all messages in the group (download now)
-    media_files = []
+    # The files are downloaded concurrently, keeping the order of the messages
+    downloads = []
     for msg in messages:
         # Download media from each message
         if msg.photo:
             largest_photo = max(msg.photo, key=lambda p: p.file_size if p.file_size else 0)
             logger.info(f"Downloading photo from media group message...")
-            temp_file = await download_media_file(context.bot, largest_photo, 'jpg')
-            if temp_file:
-                media_files.append(temp_file)
+            downloads.append(download_media_file(context.bot, largest_photo, 'jpg'))
         elif msg.video:
             logger.info(f"Downloading video from media group message...")
-            temp_file = await download_media_file(context.bot, msg.video, 'mp4')
-            if temp_file:
-                media_files.append(temp_file)
+            downloads.append(download_media_file(context.bot, msg.video, 'mp4'))
         elif msg.document:
             if msg.document.mime_type:
                 if msg.document.mime_type.startswith('image/'):
@@ -2253,9 +2876,7 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
                     if not ext:
                         ext = msg.document.mime_type.split('/')[-1]
                     logger.info(f"Downloading image document from media group message...")
-                    temp_file = await download_media_file(context.bot, msg.document, ext)
-                    if temp_file:
-                        media_files.append(temp_file)
+                    downloads.append(download_media_file(context.bot, msg.document, ext))
                 elif msg.document.mime_type.startswith('video/'):
                     ext = None
                     if msg.document.file_name:
@@ -2263,25 +2884,27 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
                     if not ext:
                         ext = msg.document.mime_type.split('/')[-1]
                     logger.info(f"Downloading video document from media group message...")
-                    temp_file = await download_media_file(context.bot, msg.document, ext)
-                    if temp_file:
-                        media_files.append(temp_file)
+                    downloads.append(download_media_file(context.bot, msg.document, ext))
+    
+    download_slots = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    
+    async def download_with_slot(download):
+        async with download_slots:
+            return await download
+    
+    temp_files = await asyncio.gather(*(download_with_slot(download) for download in downloads))
+    media_files = [temp_file for temp_file in temp_files if temp_file]
     
     if not media_files:
-        logger.warning(f"No media files collected from media group {media_group_id}")
+        logger.warning("No media files collected from media group %s", media_group_id)
         return
     
-    # Try to send acknowledgment
-    status_msg = None
-    try:
-        status_msg = await send_message_with_retry(
-            first_message,
-            f"Processing media group with {len(media_files)} file(s)..."
-        )
-        if status_msg is None:
-            logger.warning("Could not send status message for media group, continuing without it")
-    except Exception as e:
-        logger.warning(f"Failed to send status message for media group: {e}, continuing without it")
+    # Send acknowledgment while the command is built and the script starts
+    status_task = asyncio.create_task(send_status_message(
+        first_message,
+        f"Processing media group with {len(media_files)} file(s)...",
+        " for media group"
+    ))
     
     try:
         # Get disable_cookies_for_sites from channel config or global config
@@ -2304,28 +2927,29 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
             disable_cookies_sites  # Get disable cookies setting from channel or global config
         )
         
-        # Execute script with timeout
+        # Execute script with timeout, waiting for a free slot if too many are running
         timeout = config.get('script_timeout', 360)
-        result = await execute_script(cmd, timeout=timeout)
+        async with get_script_semaphore(context):
+            result = await execute_script(cmd, timeout=timeout)
+        status_msg = await status_task
         
         # Clean up temporary files
         for temp_file in media_files:
             try:
                 if os.path.exists(temp_file):
                     os.unlink(temp_file)
-                    logger.debug(f"Cleaned up temporary file: {temp_file}")
+                    logger.debug("Cleaned up temporary file: %s", temp_file)
             except Exception as e:
-                logger.warning(f"Failed to clean up temporary file {temp_file}: {e}")
+                logger.warning("Failed to clean up temporary file %s: %s", temp_file, e)
         
         # Format response (same as single media processing)
         if result['success']:
-            logger.info(f"Script execution successful. stdout length: {len(result['stdout'])}, stderr length: {len(result['stderr'])}")
+            logger.info("Script execution successful. stdout length: %s, stderr length: %s", len(result['stdout']), len(result['stderr']))
+            # Output is already sanitized in execute_script
             if result['stdout']:
-                sanitized_stdout = sanitize_subprocess_output(result['stdout'])
-                logger.info(f"Script stdout:\n{sanitized_stdout}")
+                logger.info("Script stdout:\n%s", result['stdout'])
             if result['stderr']:
-                sanitized_stderr = sanitize_subprocess_output(result['stderr'])
-                logger.info(f"Script stderr:\n{sanitized_stderr}")
+                logger.info("Script stderr:\n%s", result['stderr'])
             
             event_id = None
             nevent = None
@@ -2333,42 +2957,35 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
             if result['stdout']:
                 event_id = extract_event_id(result['stdout'])
                 if event_id:
-                    logger.info(f"Extracted event ID from stdout: {event_id}")
+                    logger.info("Extracted event ID from stdout: %s", event_id)
             
             if not event_id and result['stderr']:
                 event_id = extract_event_id(result['stderr'])
                 if event_id:
-                    logger.info(f"Extracted event ID from stderr: {event_id}")
+                    logger.info("Extracted event ID from stderr: %s", event_id)
             
             if event_id:
                 nevent = await encode_to_nevent(event_id)
-                logger.info(f"Encoded to nevent: {nevent}")
+                logger.info("Encoded to nevent: %s", nevent)
             else:
                 logger.warning(f"Could not extract event ID from output for media group")
             
             if nevent:
-                if config.get('nostr_client_url'):
-                    client_url_template = config['nostr_client_url']
-                    if '{nevent}' in client_url_template:
-                        client_url = client_url_template.format(nevent=nevent)
-                    else:
-                        if client_url_template.endswith('/'):
-                            client_url = f"{client_url_template}e/{nevent}"
-                        else:
-                            client_url = f"{client_url_template}/e/{nevent}"
+                if config.get('nostr_client_url_template'):
+                    client_url = config['nostr_client_url_template'].format(nevent=nevent)
                     
                     response_msg = f"✅ [View on Nostr]({client_url})\n\n`{nevent}`"
                     if status_msg:
                         await send_message_with_retry(status_msg, response_msg, edit_text=True, parse_mode='Markdown')
                     else:
                         await send_message_with_retry(first_message, response_msg, parse_mode='Markdown')
-                    logger.info(f"Successfully processed media group, nevent: {nevent}, client_url: {client_url}")
+                    logger.info("Successfully processed media group, nevent: %s, client_url: %s", nevent, client_url)
                 else:
                     if status_msg:
                         await send_message_with_retry(status_msg, nevent, edit_text=True)
                     else:
                         await send_message_with_retry(first_message, nevent)
-                    logger.info(f"Successfully processed media group, nevent: {nevent}")
+                    logger.info("Successfully processed media group, nevent: %s", nevent)
             else:
                 logger.warning(f"Could not extract event ID from output for media group")
                 success_msg = f"✅ Successfully processed media group with {len(media_files)} file(s)"
@@ -2388,36 +3005,27 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
                 if result.get('stderr'):
                     error_parts.append(result['stderr'])
                 if result.get('stdout') and 'Partial stdout' not in (result.get('stderr') or ''):
-                    error_parts.append(f"\n--- Partial stdout before timeout ---\n{result['stdout']}")
+                    error_parts.append(("\n--- Partial stdout before timeout ---\n", result['stdout']))
                 
-                error_msg = "\n\n".join(error_parts)
-                
-                # Truncate if too long (Telegram limit)
-                MAX_ERROR_LENGTH = 3500
-                if len(error_msg) > MAX_ERROR_LENGTH:
-                    truncated_msg = error_msg[-MAX_ERROR_LENGTH:]
-                    first_newline = truncated_msg.find('\n')
-                    if first_newline > 0 and first_newline < MAX_ERROR_LENGTH * 0.2:
-                        truncated_msg = truncated_msg[first_newline+1:]
-                    error_display = f"⏱️ Script execution timed out after {timeout_seconds} seconds\n\n... (truncated, full error in logs)\n\n{truncated_msg}"
+                # Join the parts, keeping only the end if too long (Telegram limit)
+                error_msg, truncated = join_error_parts(error_parts)
+                if truncated:
+                    # Only the end is kept (most important part with actual error)
+                    error_display = f"⏱️ Script execution timed out after {timeout_seconds} seconds\n\n... (truncated, full error in logs)\n\n{error_msg}"
                 else:
                     error_display = error_msg
             else:
                 error_parts = []
                 if result['stderr']:
-                    error_parts.append(f"Error:\n{result['stderr']}")
+                    error_parts.append(("Error:\n", result['stderr']))
                 if result['stdout']:
-                    error_parts.append(f"Output:\n{result['stdout']}")
+                    error_parts.append(("Output:\n", result['stdout']))
                 
-                error_msg = "\n\n".join(error_parts) if error_parts else "Unknown error"
+                error_msg, truncated = join_error_parts(error_parts) if error_parts else ("Unknown error", False)
                 
-                MAX_ERROR_LENGTH = 3500
-                if len(error_msg) > MAX_ERROR_LENGTH:
-                    truncated_msg = error_msg[-MAX_ERROR_LENGTH:]
-                    first_newline = truncated_msg.find('\n')
-                    if first_newline > 0 and first_newline < MAX_ERROR_LENGTH * 0.2:
-                        truncated_msg = truncated_msg[first_newline+1:]
-                    error_display = f"❌ Error processing media group\n\n... (truncated, full error in logs)\n\n{truncated_msg}"
+                if truncated:
+                    # Only the end is kept (most important part with actual error)
+                    error_display = f"❌ Error processing media group\n\n... (truncated, full error in logs)\n\n{error_msg}"
                 else:
                     error_display = f"❌ Error processing media group\n\n{error_msg}"
             
@@ -2426,22 +3034,122 @@ async def process_media_group(media_group_id: str, messages: List, context: Cont
             else:
                 await send_message_with_retry(first_message, error_display)
             logger.error(f"Error processing media group")
-            sanitized_stderr = sanitize_subprocess_output(result['stderr'])
-            sanitized_stdout = sanitize_subprocess_output(result['stdout'])
-            logger.error(f"stderr: {sanitized_stderr}")
-            logger.error(f"stdout: {sanitized_stdout}")
+            sanitized_stderr = sanitize_subprocess_output(output_tail(result['stderr']))
+            sanitized_stdout = sanitize_subprocess_output(output_tail(result['stdout']))
+            logger.error("stderr: %s", sanitized_stderr)
+            logger.error("stdout: %s", sanitized_stdout)
     except Exception as e:
-        logger.exception(f"Exception while processing media group: {e}")
+        logger.exception("Exception while processing media group: %s", e)
+        # Wait for the status message so the error can replace it (send_status_message doesn't raise)
+        status_msg = await status_task
         try:
-            await send_message_with_retry(first_message, f"❌ Exception occurred: {str(e)}")
+            error_display = f"❌ Exception occurred: {str(e)}"
+            if status_msg:
+                await send_message_with_retry(status_msg, error_display, edit_text=True)
+            else:
+                await send_message_with_retry(first_message, error_display)
         except Exception as send_error:
-            logger.error(f"Failed to send error message: {send_error}")
+            logger.error("Failed to send error message: %s", send_error)
         for temp_file in media_files:
             try:
                 if os.path.exists(temp_file):
                     os.unlink(temp_file)
             except Exception:
                 pass
+    finally:
+        # Don't leave the status message task running if processing was cancelled
+        if not status_task.done():
+            status_task.cancel()
+
+
+def output_tail(output, max_length=MAX_LOGGED_OUTPUT_CHARS):
+    """Return the end of script output for logging.
+    
+    Args:
+        output: Script stdout or stderr
+        max_length: Maximum number of characters to keep
+    
+    Returns:
+        The output unchanged if short enough, otherwise its last max_length
+        characters preceded by a note of how much was omitted
+    """
+    if not output or len(output) <= max_length:
+        return output
+    return f"... ({len(output) - max_length} characters omitted)\n{output[-max_length:]}"
+
+
+def truncate_error_message(error_msg, max_length=MAX_ERROR_LENGTH):
+    """Keep the end of an error message, starting at a line boundary if possible.
+    
+    The cut moves forward to the first newline only if it is within the first
+    20% of the kept text, so the search never scans more than that window.
+    
+    Args:
+        error_msg: Full error message
+        max_length: Maximum number of characters to keep
+    
+    Returns:
+        The truncated message (at most max_length characters)
+    """
+    start = max(0, len(error_msg) - max_length)
+    first_newline = error_msg.find('\n', start, start + int(max_length * 0.2))
+    if first_newline > start:
+        return error_msg[first_newline + 1:]
+    return error_msg[start:]
+
+
+def join_error_parts(error_parts, max_length=MAX_ERROR_LENGTH):
+    """Join error message parts with blank lines, keeping only what can be shown.
+    
+    Only the last max_length characters of each piece are copied when the
+    message is too long, so large script output is never joined in full.
+    
+    Args:
+        error_parts: List of parts, each a string or a tuple of strings to concatenate
+            (e.g. ("Error:\\n", stderr))
+        max_length: Maximum message length
+    
+    Returns:
+        Tuple of (error_msg, truncated): the full message if it fits, otherwise
+        its end as returned by truncate_error_message
+    """
+    pieces = []
+    for part in error_parts:
+        if pieces:
+            pieces.append("\n\n")
+        if isinstance(part, tuple):
+            pieces.extend(part)
+        else:
+            pieces.append(part)
+    
+    if sum(len(piece) for piece in pieces) <= max_length:
+        return ''.join(pieces), False
+    # Characters dropped from a piece are more than max_length from the end of the message
+    return truncate_error_message(''.join(piece[-max_length:] for piece in pieces), max_length), True
+
+
+async def send_status_message(message, text, description=""):
+    """Send a status message, but don't fail if it can't be sent.
+    
+    Meant to run as a task alongside the script, so the Telegram round trip
+    overlaps with building the command and starting the process.
+    
+    Args:
+        message: The message to reply to
+        text: Status text
+        description: Suffix for log messages (e.g. " for media group")
+    
+    Returns:
+        The sent status message, or None if it couldn't be sent
+    """
+    try:
+        status_msg = await send_message_with_retry(message, text)
+        if status_msg is None:
+            logger.warning(f"Could not send status message{description}, continuing without it")
+        return status_msg
+    except Exception as e:
+        logger.warning(f"Failed to send status message{description}: {e}, continuing without it")
+        return None
 
 
 async def send_message_with_retry(message, text, max_retries=3, retry_delay=1.0, edit_text=False, **kwargs):
@@ -2467,11 +3175,11 @@ async def send_message_with_retry(message, text, max_retries=3, retry_delay=1.0,
             else:
                 # Sending new message
                 return await message.reply_text(text, **kwargs)
-        except (TimedOut, NetworkError) as e:
+        except (TimedOut, NetworkError, RetryAfter) as e:
             last_exception = e
             if attempt < max_retries - 1:
-                wait_time = retry_delay * (2 ** attempt)  # Exponential backoff
-                logger.warning(f"Message send attempt {attempt + 1} failed with {type(e).__name__}, retrying in {wait_time}s...")
+                wait_time = get_retry_wait_time(e, attempt, retry_delay)
+                logger.warning(f"Message send attempt {attempt + 1} failed with {type(e).__name__}, retrying in {wait_time:.1f}s...")
                 await asyncio.sleep(wait_time)
             else:
                 logger.error(f"Failed to send message after {max_retries} attempts: {e}")
@@ -2514,7 +3222,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Regular message - check if user ID matches owner_id
         is_owner = (message.from_user.id == config['owner_id'])
         if not is_owner:
-            logger.info(f"Message from non-owner user {message.from_user.id}, ignoring")
+            logger.info("Message from non-owner user %s, ignoring", message.from_user.id)
             return
         
         # Check for /reload command in direct messages (private chats)
@@ -2526,7 +3234,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 use_firefox = context.bot_data.get('use_firefox', True)
                 
                 try:
-                    logger.info(f"Reloading configuration from {config_path}")
+                    logger.info("Reloading configuration from %s", config_path)
                     cookies_file = context.bot_data.get('cookies_file')
                     new_config = load_config(config_path, use_firefox=use_firefox, cookies_file=cookies_file)
                     
@@ -2541,6 +3249,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     
                     # Update bot_data with new config
                     context.bot_data['config'] = new_config
+                    # Keep the dispatcher-level owner filter in sync
+                    owner_filter = context.bot_data.get('owner_filter')
+                    if owner_filter is not None:
+                        owner_filter.user_ids = new_config['owner_id']
                     
                     # Count channels
                     channels_count = len(new_config.get('channels', {}))
@@ -2558,10 +3270,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                         status_parts.append(f"Use Firefox: {new_config.get('use_firefox', True)}")
                     
                     await message.reply_text("\n".join(status_parts))
-                    logger.info(f"Configuration reloaded successfully. Channels: {channels_count}")
+                    logger.info("Configuration reloaded successfully. Channels: %s", channels_count)
                 except Exception as e:
                     error_msg = f"❌ Failed to reload configuration: {str(e)}"
-                    logger.exception(f"Error reloading configuration: {e}")
+                    logger.exception("Error reloading configuration: %s", e)
                     await message.reply_text(error_msg)
             return
         # For regular messages, try to find channel config based on chat
@@ -2582,9 +3294,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         if channel_config:
             is_owner = True
-            logger.info(f"Channel post accepted: chat_id={sender_chat_id}, chat={chat_id}, found matching channel config")
+            logger.info("Channel post accepted: chat_id=%s, chat=%s, found matching channel config", sender_chat_id, chat_id)
         else:
-            logger.info(f"Channel post from chat_id={sender_chat_id}, chat={chat_id}, no matching channel config found, ignoring")
+            logger.info("Channel post from chat_id=%s, chat=%s, no matching channel config found, ignoring", sender_chat_id, chat_id)
             return
     else:
         logger.info("Message has no from_user or sender_chat, ignoring")
@@ -2613,7 +3325,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             group_data = pending_media_groups[media_group_id]
             if group_data.get('processed', False):
                 # Already processed, ignore this message
-                logger.info(f"Media group {media_group_id} already processed, ignoring duplicate message")
+                logger.info("Media group %s already processed, ignoring duplicate message", media_group_id)
                 return
             
             # Add this message to the group
@@ -2621,41 +3333,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             # Update channel_config if not already set (should already be set, but just in case)
             if 'channel_config' not in group_data:
                 group_data['channel_config'] = channel_config
-            logger.info(f"Added message to media group {media_group_id} (total: {len(group_data['messages'])})")
-            
-            # Cancel the previous timeout task and create a new one (reset timeout)
-            if 'task' in group_data and not group_data['task'].done():
-                try:
-                    group_data['task'].cancel()
-                except Exception as e:
-                    logger.warning(f"Error cancelling timeout task: {e}")
-            
-            # Create new timeout task
-            async def process_group_after_timeout():
-                try:
-                    await asyncio.sleep(MEDIA_GROUP_TIMEOUT)
-                    if media_group_id in pending_media_groups:
-                        group_data = pending_media_groups[media_group_id]
-                        if not group_data.get('processed', False):
-                            group_data['processed'] = True
-                            # Get channel_config from stored group data
-                            channel_cfg = group_data.get('channel_config')
-                            await process_media_group(media_group_id, group_data['messages'], context, channel_cfg)
-                            # Clean up
-                            del pending_media_groups[media_group_id]
-                except asyncio.CancelledError:
-                    # Task was cancelled (new message arrived), this is expected
-                    pass
-                except Exception as e:
-                    logger.exception(f"Error in media group timeout task: {e}")
-                    # Clean up on error
-                    if media_group_id in pending_media_groups:
-                        del pending_media_groups[media_group_id]
+            logger.info("Added message to media group %s (total: %s)", media_group_id, len(group_data['messages']))
             
-            group_data['task'] = asyncio.create_task(process_group_after_timeout())
+            # Reset the timeout; the pending task picks up the new deadline
+            group_data['deadline'] = asyncio.get_running_loop().time() + MEDIA_GROUP_TIMEOUT
         else:
             # First message in a new media group
-            logger.info(f"Starting new media group {media_group_id}")
+            logger.info("Starting new media group %s", media_group_id)
             
             # Check if this might match an existing split group (same caption, same chat)
             # This allows us to track groups that arrive while another group is already waiting for split groups
@@ -2664,39 +3348,18 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             if potential_split_key and potential_split_key in pending_split_groups:
                 split_data = pending_split_groups[potential_split_key]
                 if not split_data.get('processed', False):
-                    logger.info(f"New media group {media_group_id} matches pending split group {potential_split_key}, will be added when processed")
+                    logger.info("New media group %s matches pending split group %s, will be added when processed", media_group_id, potential_split_key)
                     # Store a reference to the split group in the media group data for later use
                     # The actual addition will happen in process_media_group after timeout
             
-            # Create timeout task
-            async def process_group_after_timeout():
-                try:
-                    await asyncio.sleep(MEDIA_GROUP_TIMEOUT)
-                    if media_group_id in pending_media_groups:
-                        group_data = pending_media_groups[media_group_id]
-                        if not group_data.get('processed', False):
-                            group_data['processed'] = True
-                            # Get channel_config from stored group data
-                            channel_cfg = group_data.get('channel_config')
-                            await process_media_group(media_group_id, group_data['messages'], context, channel_cfg)
-                            # Clean up
-                            del pending_media_groups[media_group_id]
-                except asyncio.CancelledError:
-                    # Task was cancelled (new message arrived), this is expected
-                    pass
-                except Exception as e:
-                    logger.exception(f"Error in media group timeout task: {e}")
-                    # Clean up on error
-                    if media_group_id in pending_media_groups:
-                        del pending_media_groups[media_group_id]
-            
             pending_media_groups[media_group_id] = {
                 'messages': [message],
-                'task': asyncio.create_task(process_group_after_timeout()),
+                'task': asyncio.create_task(process_media_group_after_timeout(media_group_id, context)),
+                'deadline': asyncio.get_running_loop().time() + MEDIA_GROUP_TIMEOUT,
                 'processed': False,
                 'channel_config': channel_config  # Store channel_config for later use
             }
-            logger.info(f"Created media group {media_group_id} with first message, waiting for more...")
+            logger.info("Created media group %s with first message, waiting for more...", media_group_id)
         
         # Return early - processing will happen after timeout
         return
@@ -2744,17 +3407,12 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # If we have media files, process them
     if media_files:
-        # Try to send acknowledgment, but don't fail if it times out
-        status_msg = None
-        try:
-            status_msg = await send_message_with_retry(
-                message,
-                f"Processing {len(media_files)} media file(s)..."
-            )
-            if status_msg is None:
-                logger.warning("Could not send status message for media files, continuing without it")
-        except Exception as e:
-            logger.warning(f"Failed to send status message for media files: {e}, continuing without it")
+        # Send acknowledgment while the command is built and the script starts
+        status_task = asyncio.create_task(send_status_message(
+            message,
+            f"Processing {len(media_files)} media file(s)...",
+            " for media files"
+        ))
         
         try:
             # Get disable_cookies_for_sites from channel config or global config
@@ -2777,29 +3435,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 disable_cookies_sites  # Get disable cookies setting from channel or global config
             )
             
-            # Execute script with timeout
+            # Execute script with timeout, waiting for a free slot if too many are running
             timeout = config.get('script_timeout', 360)
-            result = await execute_script(cmd, timeout=timeout)
+            async with get_script_semaphore(context):
+                result = await execute_script(cmd, timeout=timeout)
+            status_msg = await status_task
             
             # Clean up temporary files
             for temp_file in media_files:
                 try:
                     if os.path.exists(temp_file):
                         os.unlink(temp_file)
-                        logger.debug(f"Cleaned up temporary file: {temp_file}")
+                        logger.debug("Cleaned up temporary file: %s", temp_file)
                 except Exception as e:
-                    logger.warning(f"Failed to clean up temporary file {temp_file}: {e}")
+                    logger.warning("Failed to clean up temporary file %s: %s", temp_file, e)
             
             # Format response (same as URL processing)
             if result['success']:
                 # Log stdout/stderr for debugging (always log, even on success)
-                logger.info(f"Script execution successful. stdout length: {len(result['stdout'])}, stderr length: {len(result['stderr'])}")
+                logger.info("Script execution successful. stdout length: %s, stderr length: %s", len(result['stdout']), len(result['stderr']))
+                # Output is already sanitized in execute_script
                 if result['stdout']:
-                    sanitized_stdout = sanitize_subprocess_output(result['stdout'])
-                    logger.info(f"Script stdout:\n{sanitized_stdout}")
+                    logger.info("Script stdout:\n%s", result['stdout'])
                 if result['stderr']:
-                    sanitized_stderr = sanitize_subprocess_output(result['stderr'])
-                    logger.info(f"Script stderr:\n{sanitized_stderr}")
+                    logger.info("Script stderr:\n%s", result['stderr'])
                 
                 # Try to extract event ID and convert to nevent
                 event_id = None
@@ -2809,41 +3468,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 if result['stdout']:
                     event_id = extract_event_id(result['stdout'])
                     if event_id:
-                        logger.info(f"Extracted event ID from stdout: {event_id}")
+                        logger.info("Extracted event ID from stdout: %s", event_id)
                 
                 # If not found in stdout, try stderr
                 if not event_id and result['stderr']:
                     event_id = extract_event_id(result['stderr'])
                     if event_id:
-                        logger.info(f"Extracted event ID from stderr: {event_id}")
+                        logger.info("Extracted event ID from stderr: %s", event_id)
                 
                 # Encode to nevent if we found an event ID
                 if event_id:
                     nevent = await encode_to_nevent(event_id)
-                    logger.info(f"Encoded to nevent: {nevent}")
+                    logger.info("Encoded to nevent: %s", nevent)
                 else:
-                    logger.warning(f"Could not extract event ID from stdout or stderr. stdout length: {len(result['stdout'])}, stderr length: {len(result['stderr'])}")
+                    logger.warning("Could not extract event ID from stdout or stderr. stdout length: %s, stderr length: %s", len(result['stdout']), len(result['stderr']))
                     if result['stdout']:
-                        sanitized_stdout = sanitize_subprocess_output(result['stdout'])
-                        logger.warning(f"stdout content (first 500 chars): {sanitized_stdout[:500]}")
+                        logger.warning("stdout content (first 500 chars): %s", result['stdout'][:500])
                     if result['stderr']:
-                        sanitized_stderr = sanitize_subprocess_output(result['stderr'])
-                        logger.warning(f"stderr content (first 500 chars): {sanitized_stderr[:500]}")
+                        logger.warning("stderr content (first 500 chars): %s", result['stderr'][:500])
                 
                 if nevent:
                     # Format response with nostr client link if configured
-                    if config.get('nostr_client_url'):
-                        # Format the client URL with the nevent
-                        client_url_template = config['nostr_client_url']
-                        # Replace {nevent} placeholder if present, otherwise append nevent
-                        if '{nevent}' in client_url_template:
-                            client_url = client_url_template.format(nevent=nevent)
-                        else:
-                            # If no placeholder, append /e/nevent or just nevent depending on URL
-                            if client_url_template.endswith('/'):
-                                client_url = f"{client_url_template}e/{nevent}"
-                            else:
-                                client_url = f"{client_url_template}/e/{nevent}"
+                    if config.get('nostr_client_url_template'):
+                        # Format the client URL with the nevent (template prepared in load_config)
+                        client_url = config['nostr_client_url_template'].format(nevent=nevent)
                         
                         # Create clickable link using Markdown format
                         response_msg = f"✅ [View on Nostr]({client_url})\n\n`{nevent}`"
@@ -2851,14 +3499,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                             await send_message_with_retry(status_msg, response_msg, edit_text=True, parse_mode='Markdown')
                         else:
                             await send_message_with_retry(message, response_msg, parse_mode='Markdown')
-                        logger.info(f"Successfully processed media files, nevent: {nevent}, client_url: {client_url}")
+                        logger.info("Successfully processed media files, nevent: %s, client_url: %s", nevent, client_url)
                     else:
                         # Return only the nevent formatted ID if no client URL configured
                         if status_msg:
                             await send_message_with_retry(status_msg, nevent, edit_text=True)
                         else:
                             await send_message_with_retry(message, nevent)
-                        logger.info(f"Successfully processed media files, nevent: {nevent}")
+                        logger.info("Successfully processed media files, nevent: %s", nevent)
                 else:
                     # Fallback if we couldn't extract/encode event ID
                     logger.warning(f"Could not extract event ID from output for media files")
@@ -2879,40 +3527,29 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     if result.get('stderr'):
                         error_parts.append(result['stderr'])
                     if result.get('stdout') and 'Partial stdout' not in (result.get('stderr') or ''):
-                        error_parts.append(f"\n--- Partial stdout before timeout ---\n{result['stdout']}")
+                        error_parts.append(("\n--- Partial stdout before timeout ---\n", result['stdout']))
                     
-                    error_msg = "\n\n".join(error_parts)
-                    
-                    # Truncate if too long (Telegram limit)
-                    MAX_ERROR_LENGTH = 3500
-                    if len(error_msg) > MAX_ERROR_LENGTH:
-                        truncated_msg = error_msg[-MAX_ERROR_LENGTH:]
-                        first_newline = truncated_msg.find('\n')
-                        if first_newline > 0 and first_newline < MAX_ERROR_LENGTH * 0.2:
-                            truncated_msg = truncated_msg[first_newline+1:]
-                        error_display = f"⏱️ Script execution timed out after {timeout_seconds} seconds\n\n... (truncated, full error in logs)\n\n{truncated_msg}"
+                    # Join the parts, keeping only the end if too long (Telegram limit)
+                    error_msg, truncated = join_error_parts(error_parts)
+                    if truncated:
+                        # Only the end is kept (most important part with actual error)
+                        error_display = f"⏱️ Script execution timed out after {timeout_seconds} seconds\n\n... (truncated, full error in logs)\n\n{error_msg}"
                     else:
                         error_display = error_msg
                 else:
                     # Combine stderr and stdout for error messages (bash scripts often use both)
                     error_parts = []
                 if result['stderr']:
-                    error_parts.append(f"Error:\n{result['stderr']}")
+                    error_parts.append(("Error:\n", result['stderr']))
                 if result['stdout']:
-                    error_parts.append(f"Output:\n{result['stdout']}")
+                    error_parts.append(("Output:\n", result['stdout']))
                 
-                error_msg = "\n\n".join(error_parts) if error_parts else "Unknown error"
+                error_msg, truncated = join_error_parts(error_parts) if error_parts else ("Unknown error", False)
                 
                 # Telegram has a 4096 character limit per message, so limit to ~3500 to leave room for prefix
-                MAX_ERROR_LENGTH = 3500
-                if len(error_msg) > MAX_ERROR_LENGTH:
-                    # Truncate from the beginning, keep the end (most important part with actual error)
-                    truncated_msg = error_msg[-MAX_ERROR_LENGTH:]
-                    # Try to truncate at a newline if possible (find first newline in truncated message)
-                    first_newline = truncated_msg.find('\n')
-                    if first_newline > 0 and first_newline < MAX_ERROR_LENGTH * 0.2:  # If we can find a newline in the first 20%
-                        truncated_msg = truncated_msg[first_newline+1:]
-                    error_display = f"❌ Error processing media file(s)\n\n... (truncated, full error in logs)\n\n{truncated_msg}"
+                if truncated:
+                    # Only the end is kept (most important part with actual error)
+                    error_display = f"❌ Error processing media file(s)\n\n... (truncated, full error in logs)\n\n{error_msg}"
                 else:
                     error_display = f"❌ Error processing media file(s)\n\n{error_msg}"
                 
@@ -2921,17 +3558,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 else:
                     await send_message_with_retry(message, error_display)
                 logger.error(f"Error processing media files")
-                sanitized_stderr = sanitize_subprocess_output(result['stderr'])
-                sanitized_stdout = sanitize_subprocess_output(result['stdout'])
-                logger.error(f"stderr: {sanitized_stderr}")
-                logger.error(f"stdout: {sanitized_stdout}")
+                sanitized_stderr = sanitize_subprocess_output(output_tail(result['stderr']))
+                sanitized_stdout = sanitize_subprocess_output(output_tail(result['stdout']))
+                logger.error("stderr: %s", sanitized_stderr)
+                logger.error("stdout: %s", sanitized_stdout)
         except Exception as e:
-            logger.exception(f"Exception while processing media files: {e}")
+            logger.exception("Exception while processing media files: %s", e)
+            # Wait for the status message so the error can replace it (send_status_message doesn't raise)
+            status_msg = await status_task
             # Try to send error message, but don't fail if it times out
             try:
-                await send_message_with_retry(message, f"❌ Exception occurred: {str(e)}")
+                error_display = f"❌ Exception occurred: {str(e)}"
+                if status_msg:
+                    await send_message_with_retry(status_msg, error_display, edit_text=True)
+                else:
+                    await send_message_with_retry(message, error_display)
             except Exception as send_error:
-                logger.error(f"Failed to send error message: {send_error}")
+                logger.error("Failed to send error message: %s", send_error)
             # Clean up temporary files on error
             for temp_file in media_files:
                 try:
@@ -2939,29 +3582,24 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                         os.unlink(temp_file)
                 except Exception:
                     pass
+        finally:
+            # Don't leave the status message task running if processing was cancelled
+            if not status_task.done():
+                status_task.cancel()
         return
     
-    # Extract URLs
-    urls = extract_urls(text)
+    # Extract URLs and the extra text after them
+    urls, extra_text = split_urls_and_text(text)
     
     if not urls:
         logger.info("No URLs found in message")
         return
     
-    # Extract extra text after URLs
-    extra_text = extract_extra_text(text, urls)
-    
-    # Try to send acknowledgment, but don't fail if it times out
-    status_msg = None
-    try:
-        status_msg = await send_message_with_retry(
-            message,
-            f"Processing {len(urls)} URL(s): {urls[0][:50]}{'...' if len(urls[0]) > 50 else ''}..."
-        )
-        if status_msg is None:
-            logger.warning("Could not send status message, continuing without it")
-    except Exception as e:
-        logger.warning(f"Failed to send status message: {e}, continuing without it")
+    # Send acknowledgment while the command is built and the script starts
+    status_task = asyncio.create_task(send_status_message(
+        message,
+        f"Processing {len(urls)} URL(s): {urls[0][:50]}{'...' if len(urls[0]) > 50 else ''}..."
+    ))
     
     try:
         # Get disable_cookies_for_sites from channel config or global config
@@ -2984,20 +3622,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             disable_cookies_sites  # Get disable cookies setting from channel or global config
         )
         
-        # Execute script with timeout
+        # Execute script with timeout, waiting for a free slot if too many are running
         timeout = config.get('script_timeout', 360)
-        result = await execute_script(cmd, timeout=timeout)
+        async with get_script_semaphore(context):
+            result = await execute_script(cmd, timeout=timeout)
+        status_msg = await status_task
         
         # Format response
         if result['success']:
             # Log stdout/stderr for debugging (always log, even on success)
-            logger.info(f"Script execution successful. stdout length: {len(result['stdout'])}, stderr length: {len(result['stderr'])}")
+            logger.info("Script execution successful. stdout length: %s, stderr length: %s", len(result['stdout']), len(result['stderr']))
+            # Output is already sanitized in execute_script
             if result['stdout']:
-                # Output is already sanitized in execute_script, but sanitize again as safety measure
-                logger.info(f"Script stdout:\n{result['stdout']}")
+                logger.info("Script stdout:\n%s", result['stdout'])
             if result['stderr']:
-                # Output is already sanitized in execute_script, but sanitize again as safety measure
-                logger.info(f"Script stderr:\n{result['stderr']}")
+                logger.info("Script stderr:\n%s", result['stderr'])
             
             # Try to extract event ID and convert to nevent
             # Check both stdout and stderr, as the script might output to either
@@ -3008,42 +3647,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             if result['stdout']:
                 event_id = extract_event_id(result['stdout'])
                 if event_id:
-                    logger.info(f"Extracted event ID from stdout: {event_id}")
+                    logger.info("Extracted event ID from stdout: %s", event_id)
             
             # If not found in stdout, try stderr
             if not event_id and result['stderr']:
                 event_id = extract_event_id(result['stderr'])
                 if event_id:
-                    logger.info(f"Extracted event ID from stderr: {event_id}")
+                    logger.info("Extracted event ID from stderr: %s", event_id)
             
             # Encode to nevent if we found an event ID
             if event_id:
                 nevent = await encode_to_nevent(event_id)
-                logger.info(f"Encoded to nevent: {nevent}")
+                logger.info("Encoded to nevent: %s", nevent)
             else:
-                logger.warning(f"Could not extract event ID from stdout or stderr. stdout length: {len(result['stdout'])}, stderr length: {len(result['stderr'])}")
+                logger.warning("Could not extract event ID from stdout or stderr. stdout length: %s, stderr length: %s", len(result['stdout']), len(result['stderr']))
                 if result['stdout']:
-                    sanitized_stdout = sanitize_subprocess_output(result['stdout'])
-                    logger.warning(f"stdout content (first 500 chars): {sanitized_stdout[:500]}")
+                    logger.warning("stdout content (first 500 chars): %s", result['stdout'][:500])
                 if result['stderr']:
-                    sanitized_stderr = sanitize_subprocess_output(result['stderr'])
-                    logger.warning(f"stderr content (first 500 chars): {sanitized_stderr[:500]}")
+                    logger.warning("stderr content (first 500 chars): %s", result['stderr'][:500])
             
             if nevent:
                 # Format response with nostr client link if configured
-                if config.get('nostr_client_url'):
-                    # Format the client URL with the nevent
-                    # Common formats: https://snort.social/e/{nevent} or https://primal.net/e/{nevent}
-                    client_url_template = config['nostr_client_url']
-                    # Replace {nevent} placeholder if present, otherwise append nevent
-                    if '{nevent}' in client_url_template:
-                        client_url = client_url_template.format(nevent=nevent)
-                    else:
-                        # If no placeholder, append /e/nevent or just nevent depending on URL
-                        if client_url_template.endswith('/'):
-                            client_url = f"{client_url_template}e/{nevent}"
-                        else:
-                            client_url = f"{client_url_template}/e/{nevent}"
+                if config.get('nostr_client_url_template'):
+                    # Format the client URL with the nevent (template prepared in load_config)
+                    client_url = config['nostr_client_url_template'].format(nevent=nevent)
                     
                     # Create clickable link using Markdown format
                     response_msg = f"✅ [View on Nostr]({client_url})\n\n`{nevent}`"
@@ -3051,17 +3678,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                         await send_message_with_retry(status_msg, response_msg, edit_text=True, parse_mode='Markdown')
                     else:
                         await send_message_with_retry(message, response_msg, parse_mode='Markdown')
-                    logger.info(f"Successfully processed URLs: {urls}, nevent: {nevent}, client_url: {client_url}")
+                    logger.info("Successfully processed URLs: %s, nevent: %s, client_url: %s", urls, nevent, client_url)
                 else:
                     # Return only the nevent formatted ID if no client URL configured
                     if status_msg:
                         await send_message_with_retry(status_msg, nevent, edit_text=True)
                     else:
                         await send_message_with_retry(message, nevent)
-                    logger.info(f"Successfully processed URLs: {urls}, nevent: {nevent}")
+                    logger.info("Successfully processed URLs: %s, nevent: %s", urls, nevent)
             else:
                 # Fallback if we couldn't extract/encode event ID
-                logger.warning(f"Could not extract event ID from output for URLs: {urls}")
+                logger.warning("Could not extract event ID from output for URLs: %s", urls)
                 success_msg = f"✅ Successfully processed {len(urls)} URL(s)"
                 if event_id:
                     success_msg += f"\nEvent ID: {event_id} (could not encode to nevent)"
@@ -3079,40 +3706,29 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 if result.get('stderr'):
                     error_parts.append(result['stderr'])
                 if result.get('stdout') and 'Partial stdout' not in (result.get('stderr') or ''):
-                    error_parts.append(f"\n--- Partial stdout before timeout ---\n{result['stdout']}")
+                    error_parts.append(("\n--- Partial stdout before timeout ---\n", result['stdout']))
                 
-                error_msg = "\n\n".join(error_parts)
-                
-                # Truncate if too long (Telegram limit)
-                MAX_ERROR_LENGTH = 3500
-                if len(error_msg) > MAX_ERROR_LENGTH:
-                    truncated_msg = error_msg[-MAX_ERROR_LENGTH:]
-                    first_newline = truncated_msg.find('\n')
-                    if first_newline > 0 and first_newline < MAX_ERROR_LENGTH * 0.2:
-                        truncated_msg = truncated_msg[first_newline+1:]
-                    error_display = f"⏱️ Script execution timed out after {timeout_seconds} seconds\n\n... (truncated, full error in logs)\n\n{truncated_msg}"
+                # Join the parts, keeping only the end if too long (Telegram limit)
+                error_msg, truncated = join_error_parts(error_parts)
+                if truncated:
+                    # Only the end is kept (most important part with actual error)
+                    error_display = f"⏱️ Script execution timed out after {timeout_seconds} seconds\n\n... (truncated, full error in logs)\n\n{error_msg}"
                 else:
                     error_display = error_msg
             else:
                 # Combine stderr and stdout for error messages (bash scripts often use both)
                 error_parts = []
             if result['stderr']:
-                error_parts.append(f"Error:\n{result['stderr']}")
+                error_parts.append(("Error:\n", result['stderr']))
             if result['stdout']:
-                error_parts.append(f"Output:\n{result['stdout']}")
+                error_parts.append(("Output:\n", result['stdout']))
             
-            error_msg = "\n\n".join(error_parts) if error_parts else "Unknown error"
+            error_msg, truncated = join_error_parts(error_parts) if error_parts else ("Unknown error", False)
             
             # Telegram has a 4096 character limit per message, so limit to ~3500 to leave room for prefix
-            MAX_ERROR_LENGTH = 3500
-            if len(error_msg) > MAX_ERROR_LENGTH:
-                # Truncate from the beginning, keep the end (most important part with actual error)
-                truncated_msg = error_msg[-MAX_ERROR_LENGTH:]
-                # Try to truncate at a newline if possible (find first newline in truncated message)
-                first_newline = truncated_msg.find('\n')
-                if first_newline > 0 and first_newline < MAX_ERROR_LENGTH * 0.2:  # If we can find a newline in the first 20%
-                    truncated_msg = truncated_msg[first_newline+1:]
-                error_display = f"❌ Error processing URL(s)\n\n... (truncated, full error in logs)\n\n{truncated_msg}"
+            if truncated:
+                # Only the end is kept (most important part with actual error)
+                error_display = f"❌ Error processing URL(s)\n\n... (truncated, full error in logs)\n\n{error_msg}"
             else:
                 error_display = f"❌ Error processing URL(s)\n\n{error_msg}"
             
@@ -3120,18 +3736,28 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 await send_message_with_retry(status_msg, error_display, edit_text=True)
             else:
                 await send_message_with_retry(message, error_display)
-            logger.error(f"Error processing URLs {urls}")
-            sanitized_stderr = sanitize_subprocess_output(result['stderr'])
-            sanitized_stdout = sanitize_subprocess_output(result['stdout'])
-            logger.error(f"stderr: {sanitized_stderr}")
-            logger.error(f"stdout: {sanitized_stdout}")
+            logger.error("Error processing URLs %s", urls)
+            sanitized_stderr = sanitize_subprocess_output(output_tail(result['stderr']))
+            sanitized_stdout = sanitize_subprocess_output(output_tail(result['stdout']))
+            logger.error("stderr: %s", sanitized_stderr)
+            logger.error("stdout: %s", sanitized_stdout)
     except Exception as e:
-        logger.exception(f"Exception while processing message: {e}")
+        logger.exception("Exception while processing message: %s", e)
+        # Wait for the status message so the error can replace it (send_status_message doesn't raise)
+        status_msg = await status_task
         # Try to send error message, but don't fail if it times out
         try:
-            await send_message_with_retry(message, f"❌ Exception occurred: {str(e)}")
+            error_display = f"❌ Exception occurred: {str(e)}"
+            if status_msg:
+                await send_message_with_retry(status_msg, error_display, edit_text=True)
+            else:
+                await send_message_with_retry(message, error_display)
         except Exception as send_error:
-            logger.error(f"Failed to send error message: {send_error}")
+            logger.error("Failed to send error message: %s", send_error)
+    finally:
+        # Don't leave the status message task running if processing was cancelled
+        if not status_task.done():
+            status_task.cancel()
 
 
 async def cleanup_all_processes():
@@ -3200,9 +3826,9 @@ def setup_signal_handlers():
                     else:
                         # Unix: use killpg
                         try:
-                            os.killpg(os.getpgid(pid), signal.SIGTERM)
+                            signal_process_group(pid, signal.SIGTERM)
                             time.sleep(1)
-                            os.killpg(os.getpgid(pid), signal.SIGKILL)
+                            signal_process_group(pid, signal.SIGKILL)
                         except (ProcessLookupError, OSError):
                             pass
                 except Exception as e:
@@ -3239,14 +3865,14 @@ def main() -> None:
     
     # Validate cookies file if provided
     if args.cookies_file and not os.path.exists(args.cookies_file):
-        logger.warning(f"Cookies file specified but not found: {args.cookies_file}")
+        logger.warning("Cookies file specified but not found: %s", args.cookies_file)
         # Don't exit, just log warning - user might fix it later
     
     # Load configuration
     try:
         config = load_config(args.config, use_firefox=use_firefox, cookies_file=args.cookies_file)
     except Exception as e:
-        logger.error(f"Failed to load configuration: {e}")
+        logger.error("Failed to load configuration: %s", e)
         return
     
     if not config['bot_token']:
@@ -3270,25 +3896,28 @@ def main() -> None:
     # With multi-channel support, we listen to all chats and filter in the handler
     # based on channel configuration and owner_id
     # Support text, captions, photos, videos, and documents
-    message_filter = filters.TEXT | filters.CAPTION | filters.PHOTO | filters.VIDEO | filters.Document.ALL
+    content_filter = filters.TEXT | filters.CAPTION | filters.PHOTO | filters.VIDEO | filters.Document.ALL
+    # Drop updates that handle_message would ignore anyway at the dispatcher level:
+    # only messages from the owner, or posts sent on behalf of a chat (channel posts,
+    # which have no from_user) can ever be processed
+    owner_filter = filters.User(user_id=config['owner_id'])
+    sender_filter = owner_filter | (~filters.USER & filters.SenderChat.ALL)
+    message_filter = content_filter & sender_filter
+    application.bot_data['owner_filter'] = owner_filter
     
     application.add_handler(MessageHandler(message_filter, handle_message))
     
     # Start the bot
     logger.info("Starting bot...")
-    logger.info(f"Owner ID: {config['owner_id']}")
-    logger.info(f"Script path: {config['script_path']}")
+    logger.info("Owner ID: %s", config['owner_id'])
+    logger.info("Script path: %s", config['script_path'])
     if config.get('cookies_file'):
-        logger.info(f"Cookies file: {config['cookies_file']}")
+        logger.info("Cookies file: %s", config['cookies_file'])
     else:
-        logger.info(f"Use Firefox: {config.get('use_firefox', True)}")
+        logger.info("Use Firefox: %s", config.get('use_firefox', True))
     channels = config.get('channels', {})
     if channels:
-        logger.info(f"Configured channels: {len(channels)}")
-        for channel_name, channel_config in channels.items():
-            chat_id = channel_config.get('chat_id', 'N/A')
-            profile_name = channel_config.get('profile_name', 'N/A')
-            logger.info(f"  - {channel_name}: chat_id={chat_id}, profile_name={profile_name}")
+        logger.info("Configured channels: %s\n%s", len(channels), config['channels_summary'])
     else:
         logger.info("No channels configured - will only process messages from owner")
     logger.info("Bot is ready and listening for messages...")
@@ -3300,10 +3929,10 @@ def main() -> None:
         logger.info("Received KeyboardInterrupt (Ctrl+C), cleaning up processes...")
         # Kill all processes synchronously (for Windows and Unix)
         if running_processes:
-            logger.info(f"Cleaning up {len(running_processes)} tracked process(es)...")
+            logger.info("Cleaning up %s tracked process(es)...", len(running_processes))
             pids_to_kill = list(running_processes.keys())
             for pid in pids_to_kill:
-                logger.info(f"Killing process tree for PID {pid}...")
+                logger.info("Killing process tree for PID %s...", pid)
                 try:
                     if PSUTIL_AVAILABLE:
                         try:
@@ -3333,13 +3962,13 @@ def main() -> None:
                     else:
                         # Unix: use killpg
                         try:
-                            os.killpg(os.getpgid(pid), signal.SIGTERM)
+                            signal_process_group(pid, signal.SIGTERM)
                             time.sleep(1)
-                            os.killpg(os.getpgid(pid), signal.SIGKILL)
+                            signal_process_group(pid, signal.SIGKILL)
                         except (ProcessLookupError, OSError):
                             pass
                 except Exception as e:
-                    logger.error(f"Error killing process {pid}: {e}")
+                    logger.error("Error killing process %s: %s", pid, e)
         logger.info("Process cleanup completed, exiting...")
         raise
 
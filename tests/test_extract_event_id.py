@@ -0,0 +1,28 @@
+"""Regression checks for extract_event_id."""
+
+import pytest
+
+pytest.importorskip('telegram')
+
+from telegram_bot import extract_event_id
+
+
+HEX_A = 'a' * 64
+HEX_B = 'b' * 64
+
+
+def test_successfully_published_wins_over_earlier_generic_marker():
+    # "Successfully published" has priority over "published ... event" even
+    # when the generic line comes first in the output
+    output = (
+        'PUBLISHED the event to relay\n'
+        f'{HEX_A}\n'
+        'Successfully published event\n'
+        f'id {HEX_B} done'
+    )
+    assert extract_event_id(output) == HEX_B
+
+
+def test_generic_marker_used_without_successfully_published():
+    output = f'published the event\n{HEX_A}\nlog line'
+    assert extract_event_id(output) == HEX_A